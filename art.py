@@ -4,36 +4,62 @@ from mutagen.flac import FLAC
 from mutagen.mp4 import MP4, MP4Tags, MP4Cover
 from config import config
 import imghdr
+import time
 
 ART_DIR = config.get('Artwork', 'art_path')
 
+ART_EXTENSIONS = ['.jpg', '.png']
+"""Artwork file extensions, in order of preference"""
+
+ART_INDEX_CHECK_SEC = 5.0
+"""Interval at which to check ART_DIR for changes"""
+
+# Index of artwork files in ART_DIR, by sanitized "artist - album" name
+art_index = None
+# Artwork URIs by (artist, album), cleared whenever art_index changes
+_art_uris = {}
+_art_index_mtime = None
+_art_index_checked_at = 0
+# Folder artwork found by find_art, by directory: (directory mtime, path)
+_folder_art = {}
+# (artist, album) pairs whose artwork has been written by this process
+_resolved_albums = set()
+
 def index_art(song):
     ext = path.splitext(song['path'])[1]
 
     try:
         if ext == '.mp3':
-            tags = MP3(song['path'])
+            audio = MP3(song['path'])
         elif ext == '.flac':
-            tags = FLAC(song['path'])
+            audio = FLAC(song['path'])
         elif ext == '.m4a':
-            tags = MP4(song['path']).tags
+            audio = MP4(song['path'])
         else:
             return None
     except:
         return None
 
-    data = ''
+    save_art(song, embedded_art(audio))
 
-    if isinstance(tags, FLAC) and tags.pictures:
-        data = tags.pictures[0].data
-    elif isinstance(tags, MP3):
-        for tag in tags:
+def embedded_art(audio):
+    """Returns the artwork embedded in a parsed MP3, FLAC or MP4 file, if any"""
+    if isinstance(audio, FLAC) and audio.pictures:
+        return audio.pictures[0].data
+    elif isinstance(audio, MP3):
+        for tag in audio:
             if tag.startswith('APIC'):
-                data = tags[tag].data
-                break
-    elif isinstance(tags, MP4Tags) and 'covr' in tags and tags['covr']:
-        data = tags['covr'][0]
+                return audio[tag].data
+    elif (isinstance(audio, MP4) and isinstance(audio.tags, MP4Tags) and
+            'covr' in audio.tags and audio.tags['covr']):
+        return audio.tags['covr'][0]
+    return None
 
+def save_art(song, data):
+    """Writes a song's album art, given its embedded artwork data if any
+
+    Falls back to artwork in the song's folder.
+    """
     if not data:
         directory = find_art(song)
         if directory:
@@ -46,11 +72,28 @@ def index_art(song):
         else:
             return None
 
-    directory = write_art(song, data)
+    if write_art(song, data):
+        _resolved_albums.add((song['artist'], song['album']))
 
 def find_art(song):
-    art_strings = ['cover.jpg', 'cover.png', 'folder.jpg', 'folder.png']
+    """Returns the path of the artwork in a song's folder, if any
+
+    Results are cached per folder until the folder's mtime changes.
+    """
     directory = path.dirname(song['path'])
+    try:
+        mtime = path.getmtime(directory)
+    except OSError:
+        return None
+    cached = _folder_art.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    art_path = _find_folder_art(directory)
+    _folder_art[directory] = (mtime, art_path)
+    return art_path
+
+def _find_folder_art(directory):
+    art_strings = ['cover.jpg', 'cover.png', 'folder.jpg', 'folder.png']
     for s in art_strings:
         if path.isfile(path.join(directory, s)):
             return path.join(directory, s)
@@ -62,6 +105,17 @@ def find_art(song):
 
     return None
 
+def needs_art(artist, album):
+    """Returns whether album art should be written for an artist and album"""
+    if (artist, album) in _resolved_albums:
+        return False
+    return not get_art(artist, album)
+
+def clear_scan_cache():
+    """Forgets folder artwork and albums resolved during previous scans"""
+    _folder_art.clear()
+    _resolved_albums.clear()
+
 
 def write_art(song, data):
     if not data or not song['artist'] or not song['album']:
@@ -81,21 +135,67 @@ def write_art(song, data):
     out = open(filepath, 'w')
     out.write(data)
     out.close()
+    if art_index is not None:
+        _index_art_file(folder + ext)
+    return filepath
 
 
 def get_art(artist, album):
     if not album or not artist:
         return None
-    ext = ['.jpg', '.png']
+    _check_art_index()
 
-    name = u"{0} - {1}".format(artist, album)
-    folder = sanitize_folder_name(name)
-
-    for e in ext:
-        if path.isfile('.' + ART_DIR + folder + e):
-            return '.' + ART_DIR + folder + e
-
-    return None
+    try:
+        return _art_uris[(artist, album)]
+    except KeyError:
+        name = u"{0} - {1}".format(artist, album)
+        uri = art_index.get(sanitize_folder_name(name))
+        _art_uris[(artist, album)] = uri
+        return uri
+
+
+def load_art_index():
+    """Builds the index of artwork files in ART_DIR"""
+    global art_index, _art_index_mtime
+    art_dir = u'.' + ART_DIR
+    _art_index_mtime = path.getmtime(art_dir)
+    files = set(listdir(art_dir))
+    index = {}
+    for f in files:
+        name, ext = path.splitext(f)
+        if ext in ART_EXTENSIONS and name not in index:
+            for e in ART_EXTENSIONS:
+                if name + e in files:
+                    index[name] = art_dir + name + e
+                    break
+    art_index = index
+    _art_uris.clear()
+
+
+def _index_art_file(filename):
+    """Updates the art index for a file in ART_DIR that changed"""
+    name, ext = path.splitext(filename)
+    if ext not in ART_EXTENSIONS:
+        return
+    for e in ART_EXTENSIONS:
+        filepath = u'.' + ART_DIR + name + e
+        if path.isfile(filepath):
+            art_index[name] = filepath
+            break
+    else:
+        art_index.pop(name, None)
+    _art_uris.clear()
+
+
+def _check_art_index():
+    """Loads the art index, or reloads it if ART_DIR has changed"""
+    global _art_index_checked_at
+    if art_index is None:
+        load_art_index()
+    elif time.time() - _art_index_checked_at > ART_INDEX_CHECK_SEC:
+        _art_index_checked_at = time.time()
+        if path.getmtime('.' + ART_DIR) != _art_index_mtime:
+            load_art_index()
 
 def sanitize_folder_name(name):
     keepcharacters = (' ','.','_','-')
@@ -0,0 +1,128 @@
+"""
+Picks songs to play when nobody has queued anything.
+
+A small buffer of songs is chosen ahead of time by a background thread, so
+that the scheduler can switch to one as soon as the queue empties. Songs are
+chosen at random, weighted away from songs that were played recently.
+"""
+
+from config import config
+from db import Session, PlayHistory
+import song
+import collections
+import random
+import threading
+
+PLAYER_NAME = config.get('Player', 'player_name')
+
+AUTO_DJ_BUFFER_SIZE = 3
+"""Number of songs to choose ahead of time"""
+
+AUTO_DJ_CANDIDATES = 8
+"""Number of random songs to choose each buffered song from"""
+
+AUTO_DJ_RECENT_PLAYS = 200
+"""Number of recently played songs to weight against"""
+
+
+class AutoDJ(object):
+    def __init__(self):
+        self._buffer = collections.deque()
+        self._recent = None
+        self._condition = threading.Condition()
+
+    def next_song(self):
+        """
+        Returns the QueuedPacket arguments for the next song to play, or None
+        if the library is empty
+
+        Takes a song from the buffer and wakes up the refill thread. Only
+        chooses a song on the spot if the buffer has not been filled yet.
+        """
+        with self._condition:
+            details = self._buffer.popleft() if self._buffer else None
+            self._condition.notify()
+        if details is None:
+            details = self._choose_song()
+        return details
+
+    def played(self, song_id):
+        """Records that a song was played"""
+        with self._condition:
+            if self._recent is not None:
+                self._recent.append(song_id)
+            self._buffer = collections.deque(
+                details for details in self._buffer
+                if details['song_id'] != song_id)
+            self._condition.notify()
+
+    def start(self):
+        """Starts filling the buffer in the background"""
+        thread = threading.Thread(target=self._refill_thread)
+        thread.daemon = True
+        thread.start()
+
+    def _refill_thread(self):
+        while True:
+            with self._condition:
+                while len(self._buffer) >= AUTO_DJ_BUFFER_SIZE:
+                    self._condition.wait()
+            try:
+                details = self._choose_song()
+            except Exception, e:
+                print 'Error choosing an auto-DJ song: %s' % e
+                details = None
+            with self._condition:
+                if details is None:
+                    # Library is empty or unavailable; try again later
+                    self._condition.wait(60)
+                elif all(details['song_id'] != buffered['song_id']
+                         for buffered in self._buffer):
+                    self._buffer.append(details)
+
+    def _choose_song(self):
+        """
+        Chooses one of AUTO_DJ_CANDIDATES random songs, weighting each by how
+        long ago it was last played among the AUTO_DJ_RECENT_PLAYS most
+        recent plays
+        """
+        recent = self._recent_plays()
+        candidates = song.random_songs(limit=AUTO_DJ_CANDIDATES)['results']
+        if not candidates:
+            return None
+
+        weights = []
+        for candidate in candidates:
+            if candidate['id'] in recent:
+                # Number of plays since this song was last played
+                age = recent.index(candidate['id'])
+                weights.append(float(age) / AUTO_DJ_RECENT_PLAYS)
+            else:
+                weights.append(1.0)
+
+        choice = random.uniform(0, sum(weights))
+        for candidate, weight in zip(candidates, weights):
+            choice -= weight
+            if choice <= 0:
+                break
+        return {'song_id': candidate['id'], 'length': candidate['length']}
+
+    def _recent_plays(self):
+        """Returns a copy of the recently played song ids, most recent first"""
+        with self._condition:
+            recent = self._recent
+        if recent is None:
+            session = Session()
+            rows = (session.query(PlayHistory.song_id)
+                    .filter_by(player_name=PLAYER_NAME)
+                    .order_by(PlayHistory.id.desc())
+                    .limit(AUTO_DJ_RECENT_PLAYS).all())
+            session.commit()
+            with self._condition:
+                if self._recent is None:
+                    self._recent = collections.deque(
+                        reversed([row.song_id for row in rows]),
+                        maxlen=AUTO_DJ_RECENT_PLAYS)
+                recent = self._recent
+        with self._condition:
+            return list(reversed(recent))
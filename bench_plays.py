@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# Benchmarks windowed top songs and artists against synthetic play history.
+# Usage: ./bench_plays.py DATABASE_URL [--plays N] [--songs N] [--days N]
+# DATABASE_URL must point at a scratch MySQL database, not the library's.
+"""
+Fills a scratch database with synthetic play history (10,000,000 plays by
+default), builds the hourly and daily play buckets from it the way their
+migration does, and times top_songs and top_artists for each window against
+the equivalent GROUP BY over play_history.
+"""
+
+from db import Base, Session, Song, PlayHistory
+from sqlalchemy import create_engine
+from sqlalchemy.sql import select
+from sqlalchemy.sql.expression import func, text
+import argparse
+import datetime
+import random
+import song
+import time
+
+INSERT_BATCH_SIZE = 10000
+
+PLAYER_NAME = 'bench'
+
+
+def fill_songs(conn, num_songs):
+    table = Song.__table__
+    existing = conn.execute(select([func.count()]).select_from(table)).scalar()
+    batch = []
+    for i in xrange(existing, num_songs):
+        batch.append({'title': u'Song %d' % i, 'artist': u'Artist %d' % (i / 12),
+                      'album': u'Album %d' % (i / 12), 'length': 180.0,
+                      'tracknumber': i % 12 + 1,
+                      'path': u'/bench/%d.mp3' % i})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+    return [row.id for row in conn.execute(select([table.c.id]))]
+
+
+def fill_plays(conn, song_ids, num_plays, days):
+    """
+    Inserts plays spread evenly over the last days, with song popularity
+    following a power law
+    """
+    table = PlayHistory.__table__
+    existing = conn.execute(
+        select([func.count()]).select_from(table)
+        .where(table.c.player_name == PLAYER_NAME)).scalar()
+    rng = random.Random(0)
+    now = datetime.datetime.utcnow()
+    batch = []
+    for _ in xrange(existing, num_plays):
+        song_id = song_ids[int(len(song_ids) * rng.random() ** 3)]
+        played_at = now - datetime.timedelta(seconds=rng.random() * days *
+                                             86400)
+        batch.append({'song_id': song_id, 'user': 'bench',
+                      'played_at': played_at, 'player_name': PLAYER_NAME})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+
+
+def fill_buckets(conn):
+    """Rebuilds the play buckets from play_history, as the migration does"""
+    conn.execute(text('DELETE FROM song_plays_hourly'))
+    conn.execute(text('DELETE FROM song_plays_daily'))
+    # Only the last day of hourly buckets is kept
+    conn.execute(text(
+        'INSERT INTO song_plays_hourly '
+        '(player_name, hour, song_id, play_count) '
+        'SELECT player_name, '
+        'DATE_ADD(DATE(played_at), INTERVAL HOUR(played_at) HOUR) '
+        'AS bucket, song_id, COUNT(*) FROM play_history '
+        'WHERE player_name = :player AND played_at >= :since '
+        'GROUP BY player_name, bucket, song_id'),
+        player=PLAYER_NAME,
+        since=datetime.datetime.utcnow() - song.HOURLY_PLAYS_KEPT -
+        datetime.timedelta(hours=1))
+    conn.execute(text(
+        'INSERT INTO song_plays_daily '
+        '(player_name, day, song_id, play_count) '
+        'SELECT player_name, DATE(played_at) AS bucket, song_id, '
+        'COUNT(*) FROM play_history WHERE player_name = :player '
+        'GROUP BY player_name, bucket, song_id'), player=PLAYER_NAME)
+
+
+def raw_top_songs(conn, period, limit=20):
+    """The GROUP BY over play_history that the buckets replace"""
+    table = PlayHistory.__table__
+    since = datetime.datetime.utcnow() - period
+    return conn.execute(
+        select([table.c.song_id, func.count().label('play_count')])
+        .where(table.c.player_name == PLAYER_NAME)
+        .where(table.c.played_at >= since)
+        .group_by(table.c.song_id)
+        .order_by(text('play_count DESC'))
+        .limit(limit)).fetchall()
+
+
+def time_call(name, f, repeat):
+    timings = []
+    for _ in xrange(repeat):
+        start = time.time()
+        f()
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    print '%-20s mean %9.1f ms  p50 %9.1f ms  max %9.1f ms' % (
+        name, sum(timings) / len(timings), timings[len(timings) / 2],
+        timings[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database_url')
+    parser.add_argument('--plays', type=int, default=10000000)
+    parser.add_argument('--songs', type=int, default=100000)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+    song.PLAYER_NAME = PLAYER_NAME
+
+    conn = engine.connect()
+    start = time.time()
+    song_ids = fill_songs(conn, args.songs)
+    fill_plays(conn, song_ids, args.plays, args.days)
+    print '%d plays of %d songs ready in %.1f s' % (args.plays, args.songs,
+                                                   time.time() - start)
+    start = time.time()
+    fill_buckets(conn)
+    print 'Buckets built in %.1f s' % (time.time() - start)
+
+    for window in ('day', 'week', 'month'):
+        _, _, period = song.TOP_WINDOWS[window]
+        time_call('top_songs %s' % window,
+                  lambda: song.top_songs(window=window), args.repeat)
+        time_call('top_artists %s' % window,
+                  lambda: song.top_artists(window=window), args.repeat)
+        time_call('play_history %s' % window,
+                  lambda: raw_top_songs(conn, period), args.repeat)
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# Benchmarks library scans of a synthetic tree of tagged MP3 files.
+# Usage: ./bench_scan.py [--files N] [--processes 1,2,4] [--tree DIR]
+# Scans into the database in beats.cfg, which must be a scratch database.
+"""
+Generates a tree of short silent MP3 files with ID3 tags (10,000 by default),
+then times a full scan of it with each number of worker processes, deleting
+the scanned songs in between, and a rescan in which no file changed.
+"""
+
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TRCK
+import argparse
+import os
+import shutil
+import song
+import sys
+import tempfile
+import time
+
+# One MPEG-1 layer III frame at 128 kbps and 44.1 kHz, about 26 ms of silence
+MP3_FRAME = '\xff\xfb\x90\x00' + '\x00' * 413
+
+FRAMES_PER_FILE = 40
+
+FILES_PER_ALBUM = 12
+
+
+def make_tree(root, num_files):
+    """Writes num_files tagged MP3 files under root, one directory per album"""
+    for i in xrange(num_files):
+        album = i / FILES_PER_ALBUM
+        directory = os.path.join(root, 'Artist %d' % (album / 4),
+                                 'Album %d' % album)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filepath = os.path.join(directory, '%02d.mp3' % (i % FILES_PER_ALBUM))
+        with open(filepath, 'wb') as f:
+            f.write(MP3_FRAME * FRAMES_PER_FILE)
+        tags = ID3()
+        tags.add(TIT2(encoding=3, text=u'Song %d' % i))
+        tags.add(TPE1(encoding=3, text=u'Artist %d' % (album / 4)))
+        tags.add(TALB(encoding=3, text=u'Album %d' % album))
+        tags.add(TRCK(encoding=3, text=u'%d' % (i % FILES_PER_ALBUM + 1)))
+        tags.save(filepath)
+
+
+def time_scan(root, processes):
+    # Silence the scanner's per-file output while timing it
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        num_songs = song.add_songs_in_dir(root, processes=processes)
+        return num_songs, time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--processes', default='1,2,4',
+                        help='comma-separated numbers of worker processes')
+    parser.add_argument('--tree', help='directory to generate the tree in, '
+                        'reused if it already exists')
+    args = parser.parse_args()
+
+    root = args.tree or tempfile.mkdtemp(prefix='bench_scan')
+    root = os.path.abspath(root) + '/'
+    try:
+        if not os.path.isdir(root) or not os.listdir(root):
+            start = time.time()
+            make_tree(root, args.files)
+            print 'Tree of %d files generated in %.1f s' % (
+                args.files, time.time() - start)
+
+        for processes in [int(n) for n in args.processes.split(',')]:
+            song.remove_songs_in_dir(root)
+            num_songs, elapsed = time_scan(root, processes)
+            print '%2d processes: %d songs in %6.1f s (%6.0f songs/s)' % (
+                processes, num_songs, elapsed, num_songs / elapsed)
+        num_songs, elapsed = time_scan(root, 1)
+        print 'Rescan with no changes: %d songs in %.1f s' % (num_songs,
+                                                             elapsed)
+        song.remove_songs_in_dir(root)
+    finally:
+        if not args.tree:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# Benchmarks song search against a synthetic library.
+# Usage: ./bench_search.py DATABASE_URL [--songs N] [--queries N]
+#        ./bench_search.py --index [--songs N] [--queries N]
+# DATABASE_URL must point at a scratch MySQL database, not the library's.
+"""
+Fills a scratch database with a synthetic library (500,000 songs by default)
+and times full-text search_songs queries against the LIKE scan it replaced.
+With --index, builds the in-memory word index over the synthetic library
+instead and times normalized searches, which need no database.
+"""
+
+from db import Base, Session, Song
+from search_index import TokenIndex
+from sqlalchemy import create_engine
+from sqlalchemy.sql import select
+from sqlalchemy.sql.expression import or_, func
+import argparse
+import random
+import song
+import time
+
+INSERT_BATCH_SIZE = 5000
+
+SYLLABLES = ['ba', 'ko', 'ri', 'sen', 'ta', 'mu', 'lo', 'vin', 'de', 'shi',
+             'ra', 'nel', 'po', 'gar', 'fu', 'mi', 'zan', 'tro', 'el', 'qui']
+
+
+def make_words(rng, num_words):
+    """Returns distinct pseudo-words of 2 to 4 syllables"""
+    words = set()
+    while len(words) < num_words:
+        words.add(''.join(rng.choice(SYLLABLES)
+                          for _ in xrange(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_songs(num_songs, seed=0):
+    """Yields (title, artist, album) tuples for a synthetic library"""
+    rng = random.Random(seed)
+    words = make_words(rng, 20000)
+    artists = [u' '.join(rng.sample(words, 2)).title() for _ in xrange(20000)]
+    albums = [u' '.join(rng.sample(words, rng.randint(1, 3))).title()
+              for _ in xrange(50000)]
+    for _ in xrange(num_songs):
+        title = u' '.join(rng.sample(words, rng.randint(1, 4))).title()
+        yield title, rng.choice(artists), rng.choice(albums)
+
+
+def make_queries(num_queries, seed=1):
+    """Returns a mix of one-word, two-word and partially typed queries"""
+    rng = random.Random(seed)
+    songs = list(make_songs(2000))
+    queries = []
+    for i in xrange(num_queries):
+        title, artist, _ = rng.choice(songs)
+        words = (title + u' ' + artist).lower().split()
+        if i % 3 == 0:
+            queries.append(rng.choice(words))
+        elif i % 3 == 1:
+            queries.append(u' '.join(rng.sample(words, 2)))
+        else:
+            queries.append(rng.choice(words)[:4])
+    return queries
+
+
+def fill_library(engine, num_songs):
+    """Inserts synthetic songs until the library has num_songs"""
+    conn = engine.connect()
+    table = Song.__table__
+    existing = conn.execute(select([func.count()]).select_from(table)).scalar()
+    batch = []
+    for i, (title, artist, album) in enumerate(make_songs(num_songs)):
+        if i < existing:
+            continue
+        batch.append({'title': title, 'artist': artist, 'album': album,
+                      'length': 180.0, 'tracknumber': i % 12 + 1,
+                      'path': u'/bench/%d.mp3' % i})
+        if len(batch) >= INSERT_BATCH_SIZE:
+            conn.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        conn.execute(table.insert(), batch)
+    conn.close()
+
+
+def like_search(query, limit=20):
+    """The substring search that full-text search replaced"""
+    session = Session()
+    res = session.query(Song).filter(or_(
+        Song.title.like('%' + query + '%'),
+        Song.artist.like('%' + query + '%'),
+        Song.album.like('%' + query + '%'),
+    )).limit(limit).all()
+    session.commit()
+    return res
+
+
+def time_queries(name, search, queries):
+    timings = []
+    for query in queries:
+        start = time.time()
+        search(query)
+        timings.append((time.time() - start) * 1000)
+    timings.sort()
+    print '%-12s mean %8.2f ms  p50 %8.2f ms  p95 %8.2f ms  max %8.2f ms' % (
+        name, sum(timings) / len(timings), timings[len(timings) / 2],
+        timings[int(len(timings) * 0.95)], timings[-1])
+
+
+def misspell(rng, query):
+    """Replaces one letter of the longest word in a query"""
+    words = query.split()
+    i = max(xrange(len(words)), key=lambda i: len(words[i]))
+    word = words[i]
+    j = rng.randrange(len(word))
+    words[i] = word[:j] + rng.choice('aeiou') + word[j + 1:]
+    return u' '.join(words)
+
+
+def bench_index(num_songs, num_queries):
+    start = time.time()
+    tokens = TokenIndex()
+    tokens.load((song_id, texts) for song_id, texts
+                in enumerate(make_songs(num_songs), 1))
+    print 'Index of %d songs built in %.1f s' % (num_songs,
+                                                time.time() - start)
+
+    rng = random.Random(2)
+    queries = make_queries(num_queries)
+    time_queries('normalized', lambda q: tokens.search(q, 20), queries)
+    accented = [query.replace(u'e', u'\xe9').replace(u'o', u'\xf6')
+                for query in queries]
+    time_queries('accented', lambda q: tokens.search(q, 20), accented)
+    misspelled = [misspell(rng, query) for query in queries]
+    time_queries('misspelled', lambda q: tokens.search(q, 20), misspelled)
+
+    def fifth_page(query):
+        after = None
+        for _ in xrange(5):
+            page = tokens.search(query, 20, after=after)
+            if len(page) < 20:
+                break
+            after = (page[-1][1], page[-1][0])
+    time_queries('5 pages', fifth_page, queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('database_url', nargs='?')
+    parser.add_argument('--index', action='store_true',
+                        help='benchmark the in-memory word index')
+    parser.add_argument('--songs', type=int, default=500000)
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+    if args.index:
+        bench_index(args.songs, args.queries)
+        return
+    if not args.database_url:
+        parser.error('a scratch database URL is required without --index')
+
+    engine = create_engine(args.database_url)
+    # Creating the songs table also creates its full-text index
+    Base.metadata.create_all(engine)
+    Session.configure(bind=engine)
+
+    start = time.time()
+    fill_library(engine, args.songs)
+    print 'Library of %d songs ready in %.1f s' % (args.songs,
+                                                  time.time() - start)
+
+    queries = make_queries(args.queries)
+    time_queries('fulltext', lambda q: song.search_songs(q), queries)
+    time_queries('like', like_search, queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Change notifications for clients that wait for the queue or player to change.
+
+Each Broadcast is a version number that is incremented on every change.
+Waiters block on a shared condition until any of the versions they are
+interested in differs from the one they last saw. Since versions restart
+from 0 with the process, a version held from before a restart will usually
+not match and will not block.
+"""
+
+import threading
+import time
+
+_condition = threading.Condition()
+
+
+class Broadcast(object):
+    def __init__(self):
+        self.version = 0
+
+    def notify(self):
+        """Increments the version and wakes up all waiters"""
+        with _condition:
+            self.version += 1
+            _condition.notify_all()
+
+    def wait(self, since, timeout=None):
+        """Blocks until the version differs from since, or for timeout seconds"""
+        return wait_any([(self, since)], timeout)
+
+
+def wait_any(versions, timeout=None):
+    """
+    Blocks until any (broadcast, since) pair's version differs from since, or
+    until timeout seconds pass. Returns whether a change happened.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with _condition:
+        while all(broadcast.version == since for broadcast, since in versions):
+            if deadline is None:
+                _condition.wait()
+            else:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                _condition.wait(remaining)
+        return True
@@ -1,7 +1,8 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Unicode, Float, DateTime
-from sqlalchemy import ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Unicode, Float
+from sqlalchemy import DateTime
+from sqlalchemy import ForeignKey, Index, DDL, event
 from sqlalchemy.orm import sessionmaker, relationship
 from config import config
 import art
@@ -10,7 +11,11 @@ import urllib
 
 DATABASE_URL = config.get('Database', 'url')
 
-engine = create_engine(DATABASE_URL, max_overflow=-1)
+if DATABASE_URL.startswith('sqlite'):
+    # SQLite's connection pools don't take overflow limits
+    engine = create_engine(DATABASE_URL)
+else:
+    engine = create_engine(DATABASE_URL, max_overflow=-1)
 Session = sessionmaker(bind=engine)
 Base = declarative_base()
 
@@ -30,6 +35,15 @@ class Song(Base):
     # MD5 checksum to verify file integrity
     checksum = Column(String(32))
 
+    # File size, mtime (in whole seconds) and inode as of the last scan, to
+    # detect modified files without reading them
+    file_size = Column(BigInteger)
+    file_mtime = Column(BigInteger)
+    file_inode = Column(BigInteger)
+
+    # Number of play_history rows, maintained when history is recorded
+    play_count = Column(Integer, default=0, nullable=False)
+
     packet = relationship('Packet', uselist=False, cascade='all,delete-orphan',
                           passive_deletes=True, backref='songs')
     history = relationship('PlayHistory', cascade='all,delete-orphan',
@@ -47,16 +61,10 @@ class Song(Base):
             'length': self.length,
             'path': self.path,
             'tracknumber': self.tracknumber,
-            'play_count': self.play_count(),
+            'play_count': self.play_count,
             'art_uri': art.get_art(self.artist, self.album),
         }
 
-    def play_count(self):
-        session = Session()
-        count = session.query(PlayHistory).filter_by(song_id=self.id).count()
-        session.commit()
-        return count
-
     def last_played(self):
         session = Session()
         history_item = (session.query(PlayHistory).filter_by(song_id=self.id)
@@ -66,6 +74,11 @@ class Song(Base):
             return history_item.played_at
 
 
+event.listen(Song.__table__, 'after_create', DDL(
+    'CREATE FULLTEXT INDEX songs_fulltext ON songs (title, artist, album)'
+).execute_if(dialect='mysql'))
+
+
 class PlayHistory(Base):
     __tablename__ = 'play_history'
     __table_args__ = {'mysql_engine': 'InnoDB'}
@@ -77,6 +90,64 @@ class PlayHistory(Base):
     player_name = Column(String(16))
 
 
+class SongPlayStats(Base):
+    """Number of plays of each song on each player, maintained with
+    play_history
+    """
+    __tablename__ = 'song_play_stats'
+    __table_args__ = (
+        Index('song_play_stats_top', 'player_name', 'play_count'),
+        {'mysql_engine': 'InnoDB'},
+    )
+
+    player_name = Column(String(16), primary_key=True)
+    song_id = Column(Integer, ForeignKey('songs.id', ondelete='CASCADE'),
+                     primary_key=True)
+    play_count = Column(Integer, default=0, nullable=False)
+
+
+class ArtistPlayStats(Base):
+    """Number of plays of each artist on each player, maintained with
+    play_history
+
+    Plays are credited to the song's artist at the time it was played, so
+    plays from before a song was retagged stay with its old artist.
+    """
+    __tablename__ = 'artist_play_stats'
+    __table_args__ = (
+        Index('artist_play_stats_top', 'player_name', 'play_count'),
+        {'mysql_engine': 'InnoDB'},
+    )
+
+    player_name = Column(String(16), primary_key=True)
+    artist = Column(Unicode(200), primary_key=True)
+    play_count = Column(Integer, default=0, nullable=False)
+
+
+class HourlySongPlays(Base):
+    """Number of plays of each song on each player in each hour"""
+    __tablename__ = 'song_plays_hourly'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+
+    player_name = Column(String(16), primary_key=True)
+    hour = Column(DateTime, primary_key=True)
+    song_id = Column(Integer, ForeignKey('songs.id', ondelete='CASCADE'),
+                     primary_key=True)
+    play_count = Column(Integer, default=0, nullable=False)
+
+
+class DailySongPlays(Base):
+    """Number of plays of each song on each player on each day (UTC)"""
+    __tablename__ = 'song_plays_daily'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+
+    player_name = Column(String(16), primary_key=True)
+    day = Column(DateTime, primary_key=True)
+    song_id = Column(Integer, ForeignKey('songs.id', ondelete='CASCADE'),
+                     primary_key=True)
+    play_count = Column(Integer, default=0, nullable=False)
+
+
 class Packet(Base):
     __tablename__ = 'packets'
     __table_args__ = {'mysql_engine': 'InnoDB'}
@@ -118,6 +189,16 @@ class Vote(Base):
     user = Column(String(8), primary_key=True)
 
 
+class SchedulerState(Base):
+    __tablename__ = 'scheduler_state'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+
+    player_name = Column(String(16), primary_key=True)
+    virtual_time = Column(Float)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow,
+                        onupdate=datetime.datetime.utcnow)
+
+
 class AuditLogMessage(Base):
     __tablename__ = 'audit_log'
     __table_args__ = {'mysql_engine': 'InnoDB'}
@@ -1,4 +1,7 @@
-from flask import Flask, request, jsonify, Response
+from gevent import monkey
+monkey.patch_all()
+
+from flask import Flask, request, jsonify, json, Response
 from gevent.wsgi import WSGIServer
 from functools import wraps
 from crossdomain import crossdomain
@@ -8,17 +11,26 @@ import song
 import player
 import user
 import audit_log
+from search_index import song_index
 from db import BannedUser
+import broadcast
 
 AUTHENTICATION_ENABLED = config.getboolean('Authentication', 'enabled')
 if not AUTHENTICATION_ENABLED:
     TEST_USERNAME = config.get('Authentication', 'test_username')
 
+EVENTS_TICK_SEC = 1.0
+"""Interval at which /v1/events sends the playback position"""
+
+LONG_POLL_TIMEOUT_SEC = 30.0
+"""Longest time a request with a since parameter waits for a change"""
+
 app = Flask(__name__)
 #app.debug = True
 
 scheduler = Scheduler()
 scheduler.start()
+song_index.refresh()
 
 
 def login_required(f):
@@ -45,6 +57,15 @@ def get_username(token):
         return session.json()['user']['name']
 
 
+def wait_for_change(changes):
+    """Long polling: if the request's since parameter is the current version
+    of the given Broadcast, blocks until it changes or the timeout passes.
+    """
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changes.wait(since, timeout=LONG_POLL_TIMEOUT_SEC)
+
+
 def check_eq_support(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -196,16 +217,25 @@ def show_song(song_id):
 @crossdomain(origin='*')
 def search():
     query = request.args.get('q')
+    cursor = request.args.get('cursor')
     if query.startswith('album:'):
-        return jsonify(song.get_album(query[6:].lstrip()))
+        limit = request.args.get('limit', type=int)
+        try:
+            return jsonify(song.get_album(query[6:].lstrip(), limit=limit,
+                                          cursor=cursor))
+        except ValueError, e:
+            return jsonify({'message': str(e)}), 400
     elif query.startswith('artist:'):
         return jsonify(song.get_albums_for_artist(query[7:].lstrip()))
     elif query.startswith('play-history'):
         try:
             limit = int(query[13:])
-            return jsonify(song.get_history(limit=limit))
         except ValueError:
-            return jsonify(song.get_history())
+            limit = 20
+        try:
+            return jsonify(song.get_history(limit=limit, cursor=cursor))
+        except ValueError, e:
+            return jsonify({'message': str(e)}), 400
     elif query.startswith('top-songs'):
         try:
             limit = int(query[10:])
@@ -214,9 +244,25 @@ def search():
             return jsonify(song.top_songs())
     else:
         limit = request.args.get('limit')
-        if limit and int(limit) != 0:
-            return jsonify(song.search_songs(query, limit=int(limit)))
-        return jsonify(song.search_songs(query))
+        mode = request.args.get('mode')
+        try:
+            if limit and int(limit) != 0:
+                return jsonify(song.search_songs(query, limit=int(limit),
+                                                 mode=mode, cursor=cursor))
+            return jsonify(song.search_songs(query, mode=mode,
+                                             cursor=cursor))
+        except ValueError, e:
+            return jsonify({'message': str(e)}), 400
+
+
+@app.route('/v1/songs/suggest', methods=['GET'])
+@crossdomain(origin='*')
+def suggest():
+    query = request.args.get('q')
+    limit = request.args.get('limit')
+    if limit and int(limit) != 0:
+        return jsonify(song_index.suggest(query, limit=int(limit)))
+    return jsonify(song_index.suggest(query))
 
 
 @app.route('/v1/songs/random', methods=['GET'])
@@ -232,36 +278,62 @@ def random_songs():
 @crossdomain(origin='*')
 def get_history():
     limit = request.args.get('limit')
-    if limit and int(limit) != 0:
-        return jsonify(song.get_history(limit=int(limit)))
-    return jsonify(song.get_history())
+    cursor = request.args.get('cursor')
+    try:
+        if limit and int(limit) != 0:
+            return jsonify(song.get_history(limit=int(limit), cursor=cursor))
+        return jsonify(song.get_history(cursor=cursor))
+    except ValueError, e:
+        return jsonify({'message': str(e)}), 400
 
 
 @app.route('/v1/songs/top_songs', methods=['GET'])
 @crossdomain(origin='*')
 def top_songs():
     limit = request.args.get('limit')
-    if limit and int(limit) != 0:
-        return jsonify(song.top_songs(limit=int(limit)))
-    return jsonify(song.top_songs())
+    window = request.args.get('window')
+    try:
+        if limit and int(limit) != 0:
+            return jsonify(song.top_songs(limit=int(limit), window=window))
+        return jsonify(song.top_songs(window=window))
+    except ValueError, e:
+        return jsonify({'message': str(e)}), 400
 
 
 @app.route('/v1/songs/top_artists', methods=['GET'])
 @crossdomain(origin='*')
 def top_artists():
     limit = request.args.get('limit')
-    if limit and int(limit) != 0:
-        return jsonify(song.top_artists(limit=int(limit)))
-    return jsonify(song.top_artists())
+    window = request.args.get('window')
+    try:
+        if limit and int(limit) != 0:
+            return jsonify(song.top_artists(limit=int(limit), window=window))
+        return jsonify(song.top_artists(window=window))
+    except ValueError, e:
+        return jsonify({'message': str(e)}), 400
 
 
 @app.route('/v1/queue', methods=['GET'])
 @crossdomain(origin='*')
 def show_queue():
-    queue_user = request.args.get('user')
-    if queue_user:
-        return jsonify(scheduler.get_queue(user=queue_user))
-    return jsonify(scheduler.get_queue())
+    wait_for_change(scheduler.queue_changes)
+    # Unchanged queues are answered from the queue version alone, without
+    # serializing the queue
+    version = scheduler.queue_version
+    etag = '%s-%d' % (scheduler.instance_id, version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        queue_user = request.args.get('user')
+        if queue_user:
+            queue = scheduler.get_queue(user=queue_user)
+        else:
+            queue = scheduler.get_queue()
+        queue['version'] = version
+        response = jsonify(queue)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @app.route('/v1/queue/<int:song_id>', methods=['DELETE'])
@@ -314,7 +386,62 @@ def queue_add():
 @app.route('/v1/now_playing', methods=['GET'])
 @crossdomain(origin='*')
 def now_playing():
-    return jsonify(player.get_now_playing() or {})
+    wait_for_change(player.changes)
+    version = player.changes.version
+    obj = player.get_now_playing() or {}
+    obj['version'] = version
+    return jsonify(obj)
+
+
+@app.route('/v1/events', methods=['GET'])
+@crossdomain(origin='*')
+def events():
+    """Server-sent events for the player and queue.
+
+    'player' events carry the same data as /v1/now_playing and are sent when
+    it changes, with 'tick' events carrying the playback position in between.
+    'queue' events carry the queue order as a list of keys (the song id or
+    stream url) and the items that are new or changed since the last event.
+    """
+    return Response(event_stream(request.args.get('user')),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+
+def event_stream(queue_user):
+    player_version = queue_version = None
+    sent_items = {}
+    while True:
+        if player.changes.version != player_version:
+            player_version = player.changes.version
+            yield server_sent_event('player', player.get_now_playing())
+        else:
+            yield server_sent_event('tick', player.get_position())
+
+        if scheduler.queue_version != queue_version:
+            queue_version = scheduler.queue_version
+            queue = scheduler.get_queue(user=queue_user)['queue']
+            items = dict((queue_key(item), item) for item in queue)
+            yield server_sent_event('queue', {
+                'version': queue_version,
+                'order': [queue_key(item) for item in queue],
+                'items': dict((key, item) for key, item in items.iteritems()
+                              if sent_items.get(key) != item),
+            })
+            sent_items = items
+
+        broadcast.wait_any([(player.changes, player_version),
+                            (scheduler.queue_changes, queue_version)],
+                           timeout=EVENTS_TICK_SEC)
+
+
+def queue_key(item):
+    return unicode(item.get('url') or item['id'])
+
+
+def server_sent_event(event, data):
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
 
 
 @app.route('/v1/session', methods=['POST'])
@@ -0,0 +1,27 @@
+"""Create scheduler state table
+
+Revision ID: 3c5e8a1f0d2b
+Revises: 1d198a825d9e
+Create Date: 2026-10-18 10:12:41.519203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c5e8a1f0d2b'
+down_revision = '1d198a825d9e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'scheduler_state',
+        sa.Column('player_name', sa.String(16), primary_key=True),
+        sa.Column('virtual_time', sa.Float),
+        sa.Column('updated_at', sa.DateTime)
+    )
+
+
+def downgrade():
+    op.drop_table('scheduler_state')
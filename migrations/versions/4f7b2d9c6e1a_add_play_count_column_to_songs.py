@@ -0,0 +1,26 @@
+"""Add play_count column to songs
+
+Revision ID: 4f7b2d9c6e1a
+Revises: 3c5e8a1f0d2b
+Create Date: 2026-10-18 11:03:27.284916
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4f7b2d9c6e1a'
+down_revision = '3c5e8a1f0d2b'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('songs', sa.Column('play_count', sa.Integer, nullable=False,
+                                     server_default='0'))
+    op.execute('UPDATE songs SET play_count = '
+               '(SELECT COUNT(*) FROM play_history '
+               'WHERE play_history.song_id = songs.id)')
+
+
+def downgrade():
+    op.drop_column('songs', 'play_count')
@@ -0,0 +1,23 @@
+"""Add full-text index to songs
+
+Revision ID: 52a9e0c7b3d4
+Revises: 4f7b2d9c6e1a
+Create Date: 2026-10-18 11:41:09.730152
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52a9e0c7b3d4'
+down_revision = '4f7b2d9c6e1a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE FULLTEXT INDEX songs_fulltext '
+               'ON songs (title, artist, album)')
+
+
+def downgrade():
+    op.drop_index('songs_fulltext', 'songs')
@@ -0,0 +1,55 @@
+"""Create play stats tables
+
+Revision ID: 5b1e8d3f2a70
+Revises: 52a9e0c7b3d4
+Create Date: 2026-10-18 14:21:09.531482
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b1e8d3f2a70'
+down_revision = '52a9e0c7b3d4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'song_play_stats',
+        sa.Column('player_name', sa.String(16), primary_key=True),
+        sa.Column('song_id', sa.Integer,
+                  sa.ForeignKey('songs.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('play_count', sa.Integer, nullable=False,
+                  server_default='0'),
+        mysql_engine='InnoDB'
+    )
+    op.create_index('song_play_stats_top', 'song_play_stats',
+                    ['player_name', 'play_count'])
+    op.create_table(
+        'artist_play_stats',
+        sa.Column('player_name', sa.String(16), primary_key=True),
+        sa.Column('artist', sa.Unicode(200), primary_key=True),
+        sa.Column('play_count', sa.Integer, nullable=False,
+                  server_default='0'),
+        mysql_engine='InnoDB'
+    )
+    op.create_index('artist_play_stats_top', 'artist_play_stats',
+                    ['player_name', 'play_count'])
+
+    op.execute('INSERT INTO song_play_stats (player_name, song_id, play_count) '
+               'SELECT player_name, song_id, COUNT(*) FROM play_history '
+               'WHERE player_name IS NOT NULL AND song_id IS NOT NULL '
+               'GROUP BY player_name, song_id')
+    op.execute('INSERT INTO artist_play_stats (player_name, artist, play_count) '
+               'SELECT play_history.player_name, songs.artist, COUNT(*) '
+               'FROM play_history JOIN songs ON play_history.song_id = songs.id '
+               'WHERE play_history.player_name IS NOT NULL '
+               'AND songs.artist IS NOT NULL '
+               'GROUP BY play_history.player_name, songs.artist')
+
+
+def downgrade():
+    op.drop_table('artist_play_stats')
+    op.drop_table('song_play_stats')
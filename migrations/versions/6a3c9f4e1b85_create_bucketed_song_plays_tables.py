@@ -0,0 +1,51 @@
+"""Create bucketed song plays tables
+
+Revision ID: 6a3c9f4e1b85
+Revises: 5b1e8d3f2a70
+Create Date: 2026-10-18 15:02:44.118305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a3c9f4e1b85'
+down_revision = '5b1e8d3f2a70'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    for table, column in (('song_plays_hourly', 'hour'),
+                          ('song_plays_daily', 'day')):
+        op.create_table(
+            table,
+            sa.Column('player_name', sa.String(16), primary_key=True),
+            sa.Column(column, sa.DateTime, primary_key=True),
+            sa.Column('song_id', sa.Integer,
+                      sa.ForeignKey('songs.id', ondelete='CASCADE'),
+                      primary_key=True),
+            sa.Column('play_count', sa.Integer, nullable=False,
+                      server_default='0'),
+            mysql_engine='InnoDB'
+        )
+
+    op.execute('INSERT INTO song_plays_hourly '
+               '(player_name, hour, song_id, play_count) '
+               'SELECT player_name, '
+               'DATE_ADD(DATE(played_at), INTERVAL HOUR(played_at) HOUR) '
+               'AS bucket, song_id, COUNT(*) FROM play_history '
+               'WHERE player_name IS NOT NULL AND song_id IS NOT NULL '
+               'AND played_at IS NOT NULL '
+               'GROUP BY player_name, bucket, song_id')
+    op.execute('INSERT INTO song_plays_daily '
+               '(player_name, day, song_id, play_count) '
+               'SELECT player_name, DATE(played_at) AS bucket, song_id, '
+               'COUNT(*) FROM play_history '
+               'WHERE player_name IS NOT NULL AND song_id IS NOT NULL '
+               'AND played_at IS NOT NULL '
+               'GROUP BY player_name, bucket, song_id')
+
+
+def downgrade():
+    op.drop_table('song_plays_daily')
+    op.drop_table('song_plays_hourly')
@@ -0,0 +1,26 @@
+"""Add file stat columns to songs
+
+Revision ID: 7d2f5a8c3e96
+Revises: 6a3c9f4e1b85
+Create Date: 2026-10-18 15:47:12.604938
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7d2f5a8c3e96'
+down_revision = '6a3c9f4e1b85'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('songs', sa.Column('file_size', sa.BigInteger))
+    op.add_column('songs', sa.Column('file_mtime', sa.BigInteger))
+    op.add_column('songs', sa.Column('file_inode', sa.BigInteger))
+
+
+def downgrade():
+    op.drop_column('songs', 'file_inode')
+    op.drop_column('songs', 'file_mtime')
+    op.drop_column('songs', 'file_size')
@@ -0,0 +1,171 @@
+"""
+In-memory packet queue for the packet-by-packet GPS scheduler.
+
+Queued packets are kept in per-user lists ordered by arrival time and in a
+global min-heap ordered by finish time, so votes, removals and selecting the
+next packet never have to re-sort the packets table.
+"""
+
+import heapq
+import itertools
+
+HEAP_COMPACT_MIN_STALE = 64
+"""Minimum number of stale heap entries before the heap is compacted"""
+
+
+class QueuedPacket(object):
+    """In-memory copy of a row in the packets table"""
+
+    def __init__(self, user, arrival_time, length, id=None, song_id=None,
+                 stream_url=None, stream_title=None, stream_length=None,
+                 stream_id=None, art_uri=None, artist=None, voters=()):
+        self.id = id
+        self.song_id = song_id
+        self.stream_url = stream_url
+        self.stream_title = stream_title
+        self.stream_length = stream_length
+        self.stream_id = stream_id
+        self.art_uri = art_uri
+        self.artist = artist
+        self.user = user
+        self.arrival_time = arrival_time
+        self.finish_time = None
+        self.length = float(length)
+        self.additional_voters = set(voters)
+        self._heap_entry = None
+
+    def num_votes(self):
+        return 1 + len(self.additional_voters)
+
+    def weight(self):
+        # The 1 denotes the user weight
+        return 1 * 2 ** (self.num_votes() - 1)
+
+    def has_voted(self, user):
+        return self.user == user or user in self.additional_voters
+
+
+class PacketQueue(object):
+    """Queued packets indexed by user, song and finish time"""
+
+    def __init__(self):
+        self._heap = []
+        self._num_stale = 0
+        self._counter = itertools.count()
+        self._user_packets = {}
+        self._by_song_id = {}
+        self._by_stream_url = {}
+
+    def __len__(self):
+        return len(self._by_song_id) + len(self._by_stream_url)
+
+    def num_users(self):
+        """Returns the number of users with queued packets"""
+        return len(self._user_packets)
+
+    def find(self, song_id=None, stream_url=None):
+        """Returns the queued packet for a song or stream, if any"""
+        if stream_url:
+            return self._by_stream_url.get(stream_url)
+        return self._by_song_id.get(song_id)
+
+    def add(self, packet):
+        """
+        Queues a packet behind the user's other packets
+
+        Returns the list of packets whose finish times changed.
+        """
+        if packet.stream_url:
+            self._by_stream_url[packet.stream_url] = packet
+        else:
+            self._by_song_id[packet.song_id] = packet
+        self._user_packets.setdefault(packet.user, []).append(packet)
+        return self._update_finish_times(packet)
+
+    def add_vote(self, packet, user):
+        """
+        Adds a vote to a queued packet
+
+        Returns the list of packets whose finish times changed.
+        """
+        packet.additional_voters.add(user)
+        return self._update_finish_times(packet)
+
+    def remove(self, packet):
+        """Removes a queued packet"""
+        if packet.stream_url:
+            del self._by_stream_url[packet.stream_url]
+        else:
+            del self._by_song_id[packet.song_id]
+        user_packets = self._user_packets[packet.user]
+        user_packets.remove(packet)
+        if not user_packets:
+            del self._user_packets[packet.user]
+        self._invalidate(packet)
+
+    def clear(self):
+        """Removes all queued packets"""
+        self.__init__()
+
+    def peek(self):
+        """Returns the packet with the earliest finish time"""
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+            self._num_stale -= 1
+        if self._heap:
+            return self._heap[0][-1]
+
+    def ordered(self):
+        """Returns all queued packets ordered by finish time"""
+        return [entry[-1] for entry in sorted(self._heap)
+                if entry[-1] is not None]
+
+    def _update_finish_times(self, packet):
+        """
+        Recomputes finish times starting at the given packet
+
+        Only the packet and the user's later packets can be affected. Stops as
+        soon as a finish time is unchanged, since every later packet's finish
+        time depends only on its predecessor's.
+        """
+        user_packets = self._user_packets[packet.user]
+        i = user_packets.index(packet)
+        last_finish = user_packets[i - 1].finish_time if i > 0 else None
+        changed = []
+        for packet in user_packets[i:]:
+            if last_finish is None:
+                start = packet.arrival_time
+            else:
+                start = max(last_finish, packet.arrival_time)
+            finish_time = start + packet.length / packet.weight()
+            if finish_time == packet.finish_time:
+                break
+            packet.finish_time = finish_time
+            self._push(packet)
+            changed.append(packet)
+            last_finish = finish_time
+        return changed
+
+    def _push(self, packet):
+        """Pushes a packet onto the heap at its current finish time"""
+        self._invalidate(packet)
+        entry = [packet.finish_time, packet.arrival_time,
+                 next(self._counter), packet]
+        packet._heap_entry = entry
+        heapq.heappush(self._heap, entry)
+        if (self._num_stale > HEAP_COMPACT_MIN_STALE and
+                self._num_stale > len(self._heap) / 2):
+            self._compact()
+
+    def _invalidate(self, packet):
+        """Marks the packet's heap entry as stale"""
+        if packet._heap_entry is not None:
+            packet._heap_entry[-1] = None
+            packet._heap_entry = None
+            self._num_stale += 1
+
+    def _compact(self):
+        """Drops stale entries from the heap"""
+        self._heap = [entry for entry in self._heap if entry[-1] is not None]
+        heapq.heapify(self._heap)
+        self._num_stale = 0
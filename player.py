@@ -1,5 +1,10 @@
+import errno
+import fcntl
+import os
+import select
 import threading
 import vlc
+from broadcast import Broadcast
 
 # Initial player volume
 INITIAL_VOLUME = 50
@@ -10,6 +15,9 @@ has_initialized = False
 now_playing = None
 volume = 100
 
+changes = Broadcast()
+"""Notified whenever the player status or now playing media changes"""
+
 # Equalizer functionality (requires libvlc 2.2.0 or newer)
 
 def populate_equalizer_globals(equalizer, preset_idx=0):
@@ -56,6 +64,52 @@ except NameError:
     # does not have equalizer support
     equalizer_supported = False
 
+# Transition events (end of media or playback error) are signalled through a
+# pipe, since libvlc event callbacks run on libvlc's own thread and must not
+# call back into libvlc
+transition_events_enabled = False
+_transition_pipe = os.pipe()
+fcntl.fcntl(_transition_pipe[1], fcntl.F_SETFL, os.O_NONBLOCK)
+
+
+def _on_transition(event):
+    wake()
+
+
+def enable_transition_events():
+    """Signals wait_for_transition when media ends or fails to play"""
+    global transition_events_enabled
+    if not transition_events_enabled:
+        events = player.event_manager()
+        events.event_attach(vlc.EventType.MediaPlayerEndReached,
+                            _on_transition)
+        events.event_attach(vlc.EventType.MediaPlayerEncounteredError,
+                            _on_transition)
+        transition_events_enabled = True
+
+
+def wake():
+    """Wakes up a caller blocked in wait_for_transition"""
+    if not transition_events_enabled:
+        return
+    try:
+        os.write(_transition_pipe[1], 'x')
+    except OSError, e:
+        if e.errno != errno.EAGAIN:  # Already has a pending wakeup
+            raise
+
+
+def wait_for_transition(timeout=None):
+    """
+    Blocks until media ends or fails, wake() is called, or timeout seconds
+    pass. Returns whether the wait was woken up before the timeout.
+    """
+    readable, _, _ = select.select([_transition_pipe[0]], [], [], timeout)
+    if readable:
+        os.read(_transition_pipe[0], 4096)
+    return bool(readable)
+
+
 def play(mrl):
     m = instance.media_new(mrl)
     player.set_media(m)
@@ -67,6 +121,7 @@ def play_media(media):
     play(media.mrl())
     global now_playing
     now_playing = media
+    changes.notify()
 
     # Initialize the player volume to a non-max value on first play to protect
     # eardrums. The player does not respond to volume changes right after the
@@ -81,6 +136,7 @@ def play_media(media):
 
 def pause():
     player.pause()
+    changes.notify()
     return get_status()
 
 
@@ -88,6 +144,8 @@ def stop():
     player.stop()
     global now_playing
     now_playing = None
+    wake()
+    changes.notify()
     return get_status()
 
 
@@ -106,6 +164,12 @@ def get_status():
     return status
 
 
+def get_position():
+    """Returns the playback state and position without the full status"""
+    return {'state': str(player.get_state()),
+            'current_time': player.get_time()}
+
+
 def get_now_playing():
     obj = {'player_status': get_status()}
     if now_playing:
@@ -117,6 +181,7 @@ def set_volume(vol):
     global volume
     volume = vol
     player.audio_set_volume(vol)
+    changes.notify()
     return get_status()
 
 
@@ -135,6 +200,7 @@ def set_equalizer_enabled(enabled):
     if equalizer_enabled != enabled:
         equalizer_enabled = enabled
         player.set_equalizer(equalizer if enabled else None)
+    changes.notify()
     return get_status()
 
 
@@ -145,6 +211,7 @@ def set_equalizer_preset(idx):
     populate_equalizer_globals(equalizer, preset_idx=idx)
     if equalizer_enabled:
         player.set_equalizer(equalizer)
+    changes.notify()
     return get_status()
 
 
@@ -154,6 +221,7 @@ def set_equalizer_preamp(lev):
     vlc.libvlc_audio_equalizer_set_preamp(equalizer, lev)
     if equalizer_enabled:
         player.set_equalizer(equalizer)
+    changes.notify()
     return get_status()
 
 
@@ -163,6 +231,7 @@ def set_equalizer_band(idx, lev):
     vlc.libvlc_audio_equalizer_set_amp_at_index(equalizer, lev, idx)
     if equalizer_enabled:
         player.set_equalizer(equalizer)
+    changes.notify()
     return get_status()
 
 
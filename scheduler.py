@@ -6,17 +6,29 @@ Abhay K. Parekh and Robert G. Gallager. 1993. A generalized processor sharing
 approach to flow control in integrated services networks: the single-node case.
 IEEE/ACM Trans. Netw. 1, 3 (June 1993), 344-357. DOI=10.1109/90.234856
 http://dx.doi.org/10.1109/90.234856
+
+Queued packets are scheduled in memory (see packet_queue.py). The packets and
+votes tables are a write-behind journal of the in-memory queue, written by a
+single journal thread and read back only on startup.
 """
 
+from auto_dj import AutoDJ
+from broadcast import Broadcast
 from config import config
-from db import Session, Song, PlayHistory, Packet, Vote
+from db import Session, Song, PlayHistory, Packet, Vote, SchedulerState
+from db import SongPlayStats, ArtistPlayStats, HourlySongPlays, DailySongPlays
+from packet_queue import PacketQueue, QueuedPacket
+from virtual_clock import VirtualClock
 import song
 from youtube import get_youtube_video_details, YouTubeVideo
 from soundcloudlib import get_soundcloud_music_details, SoundCloudMusic
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm.exc import FlushError
+from sqlalchemy.orm import subqueryload
+from sqlalchemy.sql.expression import bindparam
+import Queue
+import datetime
 import threading
 import time
+import uuid
 import player
 
 PLAYER_NAME = config.get('Player', 'player_name')
@@ -24,213 +36,204 @@ PLAYER_NAME = config.get('Player', 'player_name')
 SCHEDULER_INTERVAL_SEC = 0.25
 """Interval at which to run the scheduler loop"""
 
+SCHEDULER_EVENT_DRIVEN = (config.has_option('Player', 'event_driven') and
+                          config.getboolean('Player', 'event_driven'))
+"""Whether to wait for player events instead of polling the player"""
 
-class Scheduler(object):
-    virtual_time = 0.0
+SCHEDULER_EVENT_TIMEOUT_SEC = 5.0
+"""Longest interval between player checks in event-driven mode"""
 
-    active_sessions = 0
-    """Number of users with currently queued songs"""
+SCHEDULER_CHECKPOINT_SEC = 10.0
+"""Interval at which to checkpoint virtual time while songs are queued"""
 
+
+class Scheduler(object):
     def __init__(self):
+        self._lock = threading.RLock()
+        self._queue = PacketQueue()
+        self._journal = Queue.Queue()
+        self._dirty_packets = set()
+        self._queue_cache = None
+        # Queue versions restart from 0, so qualify them with a per-process id
+        self.instance_id = uuid.uuid4().hex[:8]
+        self.queue_changes = Broadcast()
+        self._clock = VirtualClock()
+        self._last_checkpoint = 0.0
+        self._auto_dj = AutoDJ()
         self._initialize_virtual_time()
-        self._update_active_sessions()
-        self._update_finish_times()
+        self._load_packets()
+
+    @property
+    def queue_version(self):
+        """Incremented whenever the queue or the now playing song changes"""
+        return self.queue_changes.version
+
+    @property
+    def active_sessions(self):
+        """Number of users with currently queued songs"""
+        return self._queue.num_users()
+
+    @property
+    def virtual_time(self):
+        """Current GPS virtual time"""
+        return self._clock.now()
+
+    @virtual_time.setter
+    def virtual_time(self, value):
+        self._clock.set(value)
+        self._checkpoint_virtual_time()
 
     def vote_song(self, user, song_id=None, stream_url=None):
         """Vote for a song"""
-        session = Session()
-
-        if stream_url:
-            packet = session.query(Packet).filter_by(
-                stream_url=stream_url, player_name=PLAYER_NAME).first()
-        elif song_id is not None:
-            packet = session.query(Packet).filter_by(
-                song_id=song_id, player_name=PLAYER_NAME).first()
-        else:
+        if not stream_url and song_id is None:
             raise Exception('Must specify either song_id or stream_url')
 
-        if packet:  # Song is already queued; add a vote
-            if user == packet.user:
-                session.rollback()
-                raise Exception('User %s has already voted for this song' %
-                                user)
-            try:
-                packet.additional_votes.append(Vote(user=user))
-                session.commit()
-            except FlushError:
-                session.rollback()
-                raise Exception('User %s has already voted for this song' %
-                                user)
-            self._update_finish_times(packet.user)
-        else:  # Song is not queued; queue it
-            if stream_url:
-                if 'www.youtube.com' in stream_url:
-                    try:
-                        video_details = get_youtube_video_details(stream_url)
-                        packet = Packet(stream_url=stream_url,
-                                        stream_title=video_details['title'],
-                                        stream_length=video_details['length'],
-                                        stream_id=video_details['stream_id'],
-                                        art_uri=video_details['art_uri'],
-                                        user=user,
-                                        arrival_time=self.virtual_time,
-                                        player_name=PLAYER_NAME)
-                        session.add(packet)
-                        session.commit()
-                    except Exception, e:
-                        session.rollback()
-                        raise e
-                elif 'soundcloud.com' in stream_url:
-                    try:
-                        track_obj = get_soundcloud_music_details(stream_url)
-                        packet = Packet(stream_url=stream_url,
-                                        stream_title=track_obj['title'],
-                                        stream_length=track_obj['length'],
-                                        stream_id=track_obj['stream_id'],
-                                        art_uri=track_obj['art_uri'],
-                                        artist=track_obj['artist'],
-                                        user=user,
-                                        arrival_time=self.virtual_time,
-                                        player_name=PLAYER_NAME)
-                        session.add(packet)
-                        session.commit()
-                    except Exception, e:
-                        session.rollback()
-                        raise e
-                else:
-                    session.rollback()
-                    raise Exception('Unsupported website')  # YouTube URL must be from YouTube
-            else:
-                try:
-                    packet = Packet(song_id=song_id,
-                                    user=user,
-                                    arrival_time=self.virtual_time,
-                                    player_name=PLAYER_NAME)
-                    session.add(packet)
-                    session.commit()
-                except IntegrityError:
-                    session.rollback()
-                    raise Exception('Song with id %d does not exist' % song_id)
-            self._update_finish_times(user)
-            self._update_active_sessions()
+        with self._lock:
+            packet = self._queue.find(song_id=song_id, stream_url=stream_url)
+            if packet:  # Song is already queued; add a vote
+                self._add_vote(packet, user)
+        if packet:
+            return self.get_queue()
+
+        # Song is not queued; look it up outside of the lock since resolving
+        # streams can take a while
+        details = self._get_packet_details(song_id, stream_url)
+
+        self._queue_packet(user, details)
+        player.wake()
         return self.get_queue()
 
-    @staticmethod
-    def num_songs_queued():
+    def num_songs_queued(self):
         """Returns the number of songs that are queued"""
-        session = Session()
-        num_songs = session.query(Packet).filter_by(
-            player_name=PLAYER_NAME).count()
-        session.commit()
-        return num_songs
+        return len(self._queue)
 
-    @staticmethod
-    def get_queue(user=None):
+    def get_queue(self, user=None):
         """
         Returns the current ordering of songs
 
         If there is a song currently playing, puts it at the front of the list.
         If user is specified, returns whether or not the user has voted for
         each song.
+
+        The ordering is cached until queue_version changes; only the has_voted
+        flags are computed per call.
         """
-        session = Session()
-        packets = (session.query(Packet).filter_by(player_name=PLAYER_NAME)
-                   .order_by(Packet.finish_time).all())
-        session.commit()
+        with self._lock:
+            cached = self._queue_cache
+            if cached is None or cached[0] != self.queue_version:
+                cached = None
+                version = self.queue_version
+                packets = self._queue.ordered()
+                voters = [packet.additional_voters | set([packet.user])
+                          for packet in packets]
+        if cached is None:
+            cached = (version,) + self._build_queue(packets, voters)
+            with self._lock:
+                if version == self.queue_version:
+                    self._queue_cache = cached
+
+        _, queue, voters = cached
+        return {'queue': [
+            dict(media_obj,
+                 packet=dict(media_obj['packet'], has_voted=user in users))
+            for media_obj, users in zip(queue, voters)]}
+
+    @staticmethod
+    def _build_queue(packets, voters):
+        """
+        Returns the serialized queue, without has_voted flags, and the voters
+        for each song in it
+        """
+        songs = song.get_songs([packet.song_id for packet in packets
+                                if not packet.stream_url])
 
         queue = []
-        for packet in packets:
+        queue_voters = []
+        for packet, users in zip(packets, voters):
             if packet.stream_url and 'www.youtube.com' in packet.stream_url:
                 video = YouTubeVideo(packet)
-                video_obj = video.dictify()
-                video_obj['packet'] = {
-                    'num_votes': packet.num_votes(),
-                    'user': packet.user,
-                    'has_voted': packet.has_voted(user),
-                }
-                queue.append(video_obj)
+                media_obj = video.dictify()
             elif packet.stream_url and 'soundcloud.com' in packet.stream_url:
                 sc = SoundCloudMusic(packet)
-                sc_obj = sc.dictify()
-                sc_obj['packet'] = {
-                    'num_votes': packet.num_votes(),
-                    'user': packet.user,
-                    'has_voted': packet.has_voted(user)
-                }
-                queue.append(sc_obj)
-            else:
-                song = session.query(Song).get(packet.song_id)
-                song_obj = song.dictify()
-                song_obj['packet'] = {
-                    'num_votes': packet.num_votes(),
-                    'user': packet.user,
-                    'has_voted': packet.has_voted(user),
-                }
-                queue.append(song_obj)
+                media_obj = sc.dictify()
+            elif packet.song_id in songs:
+                media_obj = songs[packet.song_id]
+            else:  # Deleted from the library while queued
+                continue
+            media_obj['packet'] = {
+                'num_votes': len(users),
+                'user': packet.user,
+            }
+            queue.append(media_obj)
+            queue_voters.append(users)
 
         # Put now playing song at front of list
         if player.now_playing:
-            for i, song in enumerate(queue):
+            for i, media_obj in enumerate(queue):
                 try:
-                    if player.now_playing.id == song['id']:
-                        return {'queue': [queue[i]] + queue[:i] + queue[i+1:]}
+                    if player.now_playing.id == media_obj['id']:
+                        break
                 except:
                     pass
                 try:
-                    if player.now_playing.url == song['url']:
-                        return {'queue': [queue[i]] + queue[:i] + queue[i+1:]}
+                    if player.now_playing.url == media_obj['url']:
+                        break
                 except:
                     pass
+            else:
+                return queue, queue_voters
+            queue = [queue[i]] + queue[:i] + queue[i+1:]
+            queue_voters = ([queue_voters[i]] + queue_voters[:i] +
+                            queue_voters[i+1:])
 
-        return {'queue': queue}
+        return queue, queue_voters
 
     def clear(self):
-        session = Session()
-        session.query(Packet).filter_by(player_name=PLAYER_NAME).delete()
-        session.commit()
+        with self._lock:
+            self._queue.clear()
+            self._dirty_packets.clear()
+            self._update_active_sessions()
+            self._queue_changed()
+            self._journal.put(self._delete_all_packets)
         player.stop()
         return self.get_queue()
 
     def remove_song(self, song_id, skip=False):
         """Removes the packet with the given id"""
-        session = Session()
-        packet = session.query(Packet).filter_by(
-            song_id=song_id, player_name=PLAYER_NAME).first()
-        if (isinstance(player.now_playing, Song) and
-                player.now_playing.id == song_id):
-            player.stop()
-            if skip:
-                self.virtual_time = packet.finish_time
-        session.delete(packet)
-        session.commit()
-        self._update_active_sessions()
+        with self._lock:
+            packet = self._queue.find(song_id=song_id)
+            if (isinstance(player.now_playing, Song) and
+                    player.now_playing.id == song_id):
+                player.stop()
+                if skip and packet:
+                    self.virtual_time = packet.finish_time
+            if packet:
+                self._remove_packet(packet)
         return self.get_queue()
 
     def remove_video(self, url, skip=False):
         """Removes the packet with the given stream_url"""
-        session = Session()
-        packet = session.query(Packet).filter_by(
-            stream_url=url, player_name=PLAYER_NAME).first()
-        if (isinstance(player.now_playing, YouTubeVideo) and
-                player.now_playing.url == url):
-            player.stop()
-            if skip:
-                self.virtual_time = packet.finish_time
-        elif (isinstance(player.now_playing, SoundCloudMusic) and
-                player.now_playing.url == url):
-            player.stop()
-            if skip:
-                self.virtual_time = packet.finish_time
-        session.delete(packet)
-        session.commit()
-        self._update_active_sessions()
+        with self._lock:
+            packet = self._queue.find(stream_url=url)
+            if (isinstance(player.now_playing, YouTubeVideo) and
+                    player.now_playing.url == url):
+                player.stop()
+                if skip and packet:
+                    self.virtual_time = packet.finish_time
+            elif (isinstance(player.now_playing, SoundCloudMusic) and
+                    player.now_playing.url == url):
+                player.stop()
+                if skip and packet:
+                    self.virtual_time = packet.finish_time
+            if packet:
+                self._remove_packet(packet)
         return self.get_queue()
 
     def play_next(self, skip=False):
         if self.empty():
-            random_song = song.random_songs(limit=1)['results']
-            if len(random_song) == 1:
-                self.vote_song('RANDOM', random_song[0]['id'])
+            details = self._auto_dj.next_song()
+            if details:
+                self._queue_packet('RANDOM', details)
 
         if not self.empty():
             if player.now_playing:
@@ -240,27 +243,36 @@ class Scheduler(object):
                     self.remove_video(player.now_playing.url, skip=skip)
                 else:
                     self.remove_song(player.now_playing.id, skip=skip)
-            session = Session()
-            next_packet = (session.query(Packet)
-                           .filter_by(player_name=PLAYER_NAME)
-                           .order_by(Packet.finish_time).first())
+            with self._lock:
+                next_packet = self._queue.peek()
             if next_packet:
                 if next_packet.stream_url and 'www.youtube.com' in next_packet.stream_url:
                     video = YouTubeVideo(next_packet)
                     player.play_media(video)
-                    session.commit()
+                    self._queue_changed()
                     return video.dictify()
                 elif next_packet.stream_url and 'soundcloud.com' in next_packet.stream_url:
                     video = SoundCloudMusic(next_packet)
                     player.play_media(video)
-                    session.commit()
+                    self._queue_changed()
                 else:
+                    session = Session()
                     next_song = session.query(Song).get(next_packet.song_id)
+                    if next_song is None:  # Deleted from the library
+                        session.commit()
+                        with self._lock:
+                            self._remove_packet(next_packet)
+                        return self.play_next()
                     player.play_media(next_song)
-                    next_song.history.append(
-                        PlayHistory(user=next_packet.user,
-                                    player_name=PLAYER_NAME))
+                    self._auto_dj.played(next_song.id)
+                    self._queue_changed()
+                    self._journal.put(
+                        lambda s: self._insert_play_history(s, next_packet))
+                    # Refresh the cached play count once it has been written
+                    self._journal.put(lambda s: self._queue_changed())
                     session.commit()
+                    # Reloads the attributes that the player reads after the
+                    # session is gone
                     return next_song.dictify()
 
     def empty(self):
@@ -268,61 +280,258 @@ class Scheduler(object):
         # If there are no queued songs, there are also no active sessions
         return self.active_sessions == 0
 
-    @staticmethod
-    def _update_finish_times(user=None):
-        """
-        Updates finish times for packets
-
-        If a user is specified, only update given user's queue.
+    def _queue_packet(self, user, details):
+        """Queues a packet with the given QueuedPacket arguments, or adds a
+        vote if it has been queued in the meantime
         """
-        session = Session()
+        with self._lock:
+            packet = self._queue.find(song_id=details.get('song_id'),
+                                      stream_url=details.get('stream_url'))
+            if packet:
+                self._add_vote(packet, user)
+            else:
+                packet = QueuedPacket(user=user,
+                                      arrival_time=self.virtual_time,
+                                      **details)
+                changed = self._queue.add(packet)
+                self._journal.put(lambda s: self._insert_packet(s, packet))
+                self._journal_finish_times(changed)
+                self._update_active_sessions()
+                self._queue_changed()
+
+    def _add_vote(self, packet, user):
+        """Adds a vote to a queued packet; must hold the lock"""
+        if packet.has_voted(user):
+            raise Exception('User %s has already voted for this song' % user)
+        changed = self._queue.add_vote(packet, user)
+        self._journal.put(lambda s: self._insert_vote(s, packet, user))
+        self._journal_finish_times(changed)
+        self._queue_changed()
+
+    def _remove_packet(self, packet):
+        """Removes a queued packet; must hold the lock"""
+        self._queue.remove(packet)
+        self._dirty_packets.discard(packet)
+        self._journal.put(lambda s: self._delete_packet(s, packet))
+        self._update_active_sessions()
+        self._queue_changed()
 
-        if user:
-            packets = (session.query(Packet)
-                       .filter_by(user=user, player_name=PLAYER_NAME)
-                       .order_by(Packet.arrival_time).all())
-        else:
-            packets = (session.query(Packet).filter_by(player_name=PLAYER_NAME)
-                       .order_by(Packet.arrival_time).all())
-
-        last_finish_time = {}
-        for packet in packets:
-            length = (packet.stream_length or
-                      session.query(Song).get(packet.song_id).length)
-            user = packet.user
-
-            if user in last_finish_time:
-                last_finish = max(last_finish_time[user], packet.arrival_time)
-                packet.finish_time = last_finish + length / packet.weight()
-                last_finish_time[user] = packet.finish_time
+    @staticmethod
+    def _get_packet_details(song_id=None, stream_url=None):
+        """Returns the QueuedPacket arguments for a song or stream"""
+        if stream_url:
+            if 'www.youtube.com' in stream_url:
+                video_details = get_youtube_video_details(stream_url)
+                return {'stream_url': stream_url,
+                        'stream_title': video_details['title'],
+                        'stream_length': video_details['length'],
+                        'stream_id': video_details['stream_id'],
+                        'art_uri': video_details['art_uri'],
+                        'length': video_details['length']}
+            elif 'soundcloud.com' in stream_url:
+                track_obj = get_soundcloud_music_details(stream_url)
+                return {'stream_url': stream_url,
+                        'stream_title': track_obj['title'],
+                        'stream_length': track_obj['length'],
+                        'stream_id': track_obj['stream_id'],
+                        'art_uri': track_obj['art_uri'],
+                        'artist': track_obj['artist'],
+                        'length': track_obj['length']}
             else:
-                packet.finish_time = (
-                    packet.arrival_time + length / packet.weight())
-                last_finish_time[user] = packet.finish_time
+                raise Exception('Unsupported website')  # YouTube URL must be from YouTube
 
+        session = Session()
+        row = session.query(Song.length).filter_by(id=song_id).first()
         session.commit()
+        if row is None:
+            raise Exception('Song with id %d does not exist' % song_id)
+        return {'song_id': song_id, 'length': row.length}
 
-    def _update_active_sessions(self):
-        """Updates the active_sessions member variable"""
+    def _load_packets(self):
+        """Rebuilds the in-memory queue from the packets table"""
         session = Session()
-        self.active_sessions = session.query(Packet.user).filter_by(
-            player_name=PLAYER_NAME).distinct().count()
+        rows = (session.query(Packet, Song.length)
+                .outerjoin(Song, Packet.song_id == Song.id)
+                .options(subqueryload(Packet.additional_votes))
+                .filter(Packet.player_name == PLAYER_NAME)
+                .order_by(Packet.arrival_time, Packet.id).all())
         session.commit()
 
+        changed = []
+        with self._lock:
+            for row, song_length in rows:
+                packet = QueuedPacket(
+                    id=row.id,
+                    song_id=row.song_id,
+                    stream_url=row.stream_url,
+                    stream_title=row.stream_title,
+                    stream_length=row.stream_length,
+                    stream_id=row.stream_id,
+                    art_uri=row.art_uri,
+                    artist=row.artist,
+                    user=row.user,
+                    arrival_time=row.arrival_time,
+                    length=row.stream_length or song_length,
+                    voters=[vote.user for vote in row.additional_votes])
+                changed.extend(self._queue.add(packet))
+            self._journal_finish_times(changed)
+            self._update_active_sessions()
+            self._queue_changed()
+
+    def _journal_finish_times(self, packets):
+        """Schedules a write of changed finish times; must hold the lock"""
+        if packets and not self._dirty_packets:
+            self._journal.put(self._update_finish_times)
+        self._dirty_packets.update(packets)
+
+    def _update_finish_times(self, session):
+        """Writes all pending finish time changes in a single statement"""
+        with self._lock:
+            values = [{'packet_id': packet.id, 'finish': packet.finish_time}
+                      for packet in self._dirty_packets
+                      if packet.id is not None]
+            self._dirty_packets.clear()
+        if values:
+            packets = Packet.__table__
+            session.execute(
+                packets.update()
+                .where(packets.c.id == bindparam('packet_id'))
+                .values(finish_time=bindparam('finish')),
+                values)
+
+    @staticmethod
+    def _insert_packet(session, packet):
+        row = Packet(song_id=packet.song_id,
+                     stream_url=packet.stream_url,
+                     stream_title=packet.stream_title,
+                     stream_length=packet.stream_length,
+                     stream_id=packet.stream_id,
+                     art_uri=packet.art_uri,
+                     artist=packet.artist,
+                     user=packet.user,
+                     arrival_time=packet.arrival_time,
+                     finish_time=packet.finish_time,
+                     player_name=PLAYER_NAME)
+        session.add(row)
+        session.flush()
+        packet.id = row.id
+
+    @staticmethod
+    def _insert_vote(session, packet, user):
+        if packet.id is not None:
+            session.add(Vote(packet_id=packet.id, user=user))
+
+    @staticmethod
+    def _delete_packet(session, packet):
+        if packet.id is not None:
+            session.query(Packet).filter_by(id=packet.id).delete()
+
+    @staticmethod
+    def _delete_all_packets(session):
+        session.query(Packet).filter_by(player_name=PLAYER_NAME).delete()
+
+    @staticmethod
+    def _insert_play_history(session, packet):
+        played_at = datetime.datetime.utcnow()
+        session.add(PlayHistory(song_id=packet.song_id, user=packet.user,
+                                player_name=PLAYER_NAME, played_at=played_at))
+        session.query(Song).filter_by(id=packet.song_id).update(
+            {'play_count': Song.play_count + 1}, synchronize_session=False)
+
+        # This is the only writer of this player's stats, so there is no race
+        # between updating and inserting a missing row
+        updated = (session.query(SongPlayStats)
+                   .filter_by(player_name=PLAYER_NAME, song_id=packet.song_id)
+                   .update({'play_count': SongPlayStats.play_count + 1},
+                           synchronize_session=False))
+        if not updated:
+            session.add(SongPlayStats(player_name=PLAYER_NAME,
+                                      song_id=packet.song_id, play_count=1))
+        artist = (session.query(Song.artist)
+                  .filter_by(id=packet.song_id).scalar())
+        if artist is not None:
+            updated = (session.query(ArtistPlayStats)
+                       .filter_by(player_name=PLAYER_NAME, artist=artist)
+                       .update({'play_count': ArtistPlayStats.play_count + 1},
+                               synchronize_session=False))
+            if not updated:
+                session.add(ArtistPlayStats(player_name=PLAYER_NAME,
+                                            artist=artist, play_count=1))
+
+        hour = played_at.replace(minute=0, second=0, microsecond=0)
+        day = hour.replace(hour=0)
+        for model, column, start in ((HourlySongPlays, 'hour', hour),
+                                     (DailySongPlays, 'day', day)):
+            key = {'player_name': PLAYER_NAME, 'song_id': packet.song_id,
+                   column: start}
+            updated = (session.query(model).filter_by(**key)
+                       .update({'play_count': model.play_count + 1},
+                               synchronize_session=False))
+            if not updated:
+                session.add(model(play_count=1, **key))
+
+        # No window reads older hourly buckets. This is a range delete on
+        # the primary key, so it costs nothing once they are gone.
+        (session.query(HourlySongPlays)
+         .filter(HourlySongPlays.player_name == PLAYER_NAME)
+         .filter(HourlySongPlays.hour < hour - song.HOURLY_PLAYS_KEPT)
+         .delete(synchronize_session=False))
+
+    def _journal_thread(self):
+        """Applies queued changes to the database in order"""
+        while True:
+            write = self._journal.get()
+            session = Session()
+            try:
+                write(session)
+                session.commit()
+            except Exception, e:
+                session.rollback()
+                print 'Failed to journal queue change: %s' % e
+
+    def _queue_changed(self):
+        """Invalidates the cached queue and wakes up clients waiting on it"""
+        self.queue_changes.notify()
+
+    def _update_active_sessions(self):
+        """Starts a new virtual clock segment; must hold the lock"""
+        self._clock.set_active_sessions(self.active_sessions)
+        self._checkpoint_virtual_time()
+
+    def _checkpoint_virtual_time(self):
+        """Schedules a write of the current virtual time"""
+        self._last_checkpoint = time.time()
+        self._journal.put(self._update_scheduler_state)
+
+    def _update_scheduler_state(self, session):
+        values = {'virtual_time': self.virtual_time}
+        if not (session.query(SchedulerState)
+                .filter_by(player_name=PLAYER_NAME).update(values)):
+            session.add(SchedulerState(player_name=PLAYER_NAME, **values))
+
     def _initialize_virtual_time(self):
-        """Initializes virtual time to the latest packet arrival time"""
+        """
+        Restores virtual time from the last checkpoint, or the latest packet
+        arrival time if a packet arrived after it
+        """
         session = Session()
+        state = session.query(SchedulerState).get(PLAYER_NAME)
         last_arrived_packet = (session.query(Packet)
                                .filter_by(player_name=PLAYER_NAME)
                                .order_by(Packet.arrival_time.desc()).first())
-        if last_arrived_packet:
-            self.virtual_time = last_arrived_packet.arrival_time
         session.commit()
+        virtual_time = 0.0
+        if state:
+            virtual_time = state.virtual_time
+        if last_arrived_packet:
+            virtual_time = max(virtual_time, last_arrived_packet.arrival_time)
+        self._clock.set(virtual_time)
 
-    def _increment_virtual_time(self):
-        """Increments the virtual time"""
-        if not self.empty():
-            self.virtual_time += SCHEDULER_INTERVAL_SEC / self.active_sessions
+    def _checkpoint_if_due(self):
+        """Periodically checkpoints virtual time while it is advancing"""
+        if (not self.empty() and
+                time.time() - self._last_checkpoint > SCHEDULER_CHECKPOINT_SEC):
+            self._checkpoint_virtual_time()
 
     def _scheduler_thread(self):
         """Main scheduler loop"""
@@ -331,14 +540,29 @@ class Scheduler(object):
             #     self.virtual_time, self.active_sessions)
             if player.has_ended():
                 self.play_next()
-            self._increment_virtual_time()
+            self._checkpoint_if_due()
             time.sleep(SCHEDULER_INTERVAL_SEC)
 
+    def _event_scheduler_thread(self):
+        """Scheduler loop that sleeps until the player signals a transition"""
+        while True:
+            if player.has_ended():
+                self.play_next()
+            self._checkpoint_if_due()
+            player.wait_for_transition(SCHEDULER_EVENT_TIMEOUT_SEC)
+
     def start(self):
         """Starts the scheduler"""
-        thread = threading.Thread(target=self._scheduler_thread)
-        thread.daemon = True
-        thread.start()
+        if SCHEDULER_EVENT_DRIVEN:
+            player.enable_transition_events()
+            scheduler_thread = self._event_scheduler_thread
+        else:
+            scheduler_thread = self._scheduler_thread
+        for target in (self._journal_thread, scheduler_thread):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        self._auto_dj.start()
 
 if __name__ == '__main__':
     s = Scheduler()
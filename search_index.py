@@ -0,0 +1,437 @@
+"""
+In-memory indexes over the songs table for search-as-you-type, for
+accent-insensitive, typo-tolerant word search and for sampling random songs.
+
+The index is built in the background when first used and kept up to date by
+add_songs_in_dir and remove_songs_in_dir when they run in the same process.
+Scans usually run in a separate process, so the index is also rebuilt when
+the songs table's row count or highest id changes.
+"""
+
+from db import Song, Session
+from sqlalchemy.sql.expression import func
+from array import array
+import bisect
+import heapq
+import random
+import re
+import threading
+import time
+import unicodedata
+
+INDEX_CHECK_SEC = 30.0
+"""Interval at which to check the songs table for changes by other processes"""
+
+SUGGESTION_KINDS = ('title', 'artist', 'album')
+
+PREFIX_WEIGHT = 0.9
+"""Score of a query word that matches as a prefix rather than a whole word"""
+
+PREFIX_MAX_EXPANSIONS = 50
+"""Maximum number of indexed words a partially typed word can match"""
+
+FUZZY_MIN_LENGTH = 4
+"""Shortest query word to look for misspellings of"""
+
+FUZZY_MIN_SIMILARITY = 0.5
+"""Minimum trigram similarity between a misspelled word and a match"""
+
+FUZZY_MAX_EXPANSIONS = 5
+"""Maximum number of indexed words a misspelled word can match"""
+
+FUZZY_WEIGHT = 0.8
+"""Score of a misspelled query word, multiplied by its similarity"""
+
+
+def normalize(text):
+    """Lowercases text, strips diacritics and collapses whitespace"""
+    text = unicodedata.normalize('NFKD', unicode(text).lower())
+    text = u''.join(c for c in text if not unicodedata.combining(c))
+    return u' '.join(text.split())
+
+
+def tokenize(text):
+    """Returns the normalized words in text"""
+    return re.findall(r'\w+', normalize(text), re.UNICODE)
+
+
+def trigrams(word):
+    """Returns the set of trigrams of a word, padded to mark its ends"""
+    word = u'  ' + word + u' '
+    return set(word[i:i + 3] for i in xrange(len(word) - 2))
+
+
+class PrefixIndex(object):
+    """
+    Sorted array of (normalized text, kind, text) entries, each counted once
+    per song it appears in
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._counts = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, text):
+        if not text:
+            return
+        entry = (normalize(text), kind, text)
+        count = self._counts.get(entry, 0)
+        if count == 0:
+            bisect.insort(self._entries, entry)
+        self._counts[entry] = count + 1
+
+    def remove(self, kind, text):
+        if not text:
+            return
+        entry = (normalize(text), kind, text)
+        count = self._counts.get(entry, 0)
+        if count == 1:
+            del self._entries[bisect.bisect_left(self._entries, entry)]
+            del self._counts[entry]
+        elif count > 1:
+            self._counts[entry] = count - 1
+
+    def load(self, entries):
+        """Replaces the index with the given (kind, text) entries"""
+        counts = {}
+        for kind, text in entries:
+            if text:
+                entry = (normalize(text), kind, text)
+                counts[entry] = counts.get(entry, 0) + 1
+        self._entries = sorted(counts)
+        self._counts = counts
+
+    def search(self, prefix, limit):
+        """Returns up to limit (kind, text) entries starting with prefix"""
+        prefix = normalize(prefix)
+        results = []
+        i = bisect.bisect_left(self._entries, (prefix,))
+        while i < len(self._entries) and len(results) < limit:
+            key, kind, text = self._entries[i]
+            if not key.startswith(prefix):
+                break
+            results.append((kind, text))
+            i += 1
+        return results
+
+
+class TokenIndex(object):
+    """
+    Inverted index from normalized words to sorted arrays of song ids, with a
+    sorted vocabulary for prefix matching and a trigram index over the
+    vocabulary for matching misspelled words
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._vocabulary = []
+        self._trigrams = {}
+
+    def add(self, song_id, texts):
+        for token in self._tokens(texts):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = array('i')
+                bisect.insort(self._vocabulary, token)
+                self._add_trigrams(token)
+            bisect.insort(postings, song_id)
+
+    def remove(self, song_id, texts):
+        for token in self._tokens(texts):
+            postings = self._postings.get(token)
+            if postings is not None and song_id in postings:
+                postings.remove(song_id)
+
+    def load(self, songs):
+        """Replaces the index with the given (song id, texts) pairs, which
+        must be in order of song id
+        """
+        postings = {}
+        for song_id, texts in songs:
+            for token in self._tokens(texts):
+                postings.setdefault(token, array('i')).append(song_id)
+        self._postings = postings
+        self._vocabulary = sorted(postings)
+        self._trigrams = {}
+        for token in self._vocabulary:
+            self._add_trigrams(token)
+
+    def search(self, query, limit, typos=True, after=None):
+        """
+        Returns up to limit (song id, score) pairs for songs matching every
+        word in the query, best first. The last word may be partially typed.
+
+        after: (score, song id) of the last result of the previous page, to
+        return only results ranked after it.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        matches = []
+        for i, token in enumerate(tokens):
+            expansions = self._expand(token, prefix=(i == len(tokens) - 1),
+                                      typos=typos)
+            if not expansions:
+                return []
+            matches.append(expansions)
+
+        if len(matches) == 1:
+            return self._top_songs(matches[0], limit, after)
+
+        # Intersect starting from the word with the fewest matching songs
+        matches.sort(key=lambda expansions: sum(
+            len(self._postings[token]) for token, _ in expansions))
+        scores = None
+        for expansions in matches:
+            token_scores = {}
+            num_postings = sum(len(self._postings[token])
+                               for token, _ in expansions)
+            if scores is not None and len(scores) < num_postings / 100:
+                # Few candidates left; look them up in the sorted postings
+                # instead of scanning them
+                for token, weight in expansions:
+                    postings = self._postings[token]
+                    for song_id in scores:
+                        if (token_scores.get(song_id, 0) < weight and
+                                _contains(postings, song_id)):
+                            token_scores[song_id] = weight
+            else:
+                for token, weight in expansions:
+                    for song_id in self._postings[token]:
+                        if (token_scores.get(song_id, 0) < weight and
+                                (scores is None or song_id in scores)):
+                            token_scores[song_id] = weight
+            if scores is not None:
+                for song_id in token_scores:
+                    token_scores[song_id] += scores[song_id]
+            scores = token_scores
+            if not scores:
+                return []
+        results = scores.iteritems()
+        if after is not None:
+            last_score, last_id = after
+            results = ((song_id, score) for song_id, score in results
+                       if (-score, song_id) > (-last_score, last_id))
+        return heapq.nsmallest(limit, results,
+                               key=lambda (song_id, score): (-score, song_id))
+
+    def _top_songs(self, expansions, limit, after=None):
+        """
+        Returns the best (song id, score) pairs for a single query word,
+        starting after the (score, song id) pair after, without scanning its
+        postings
+
+        Songs with the same score are ordered by id, so each score is a merge
+        of the matching postings from the first id past the cursor.
+        """
+        results = []
+        for weight in sorted(set(weight for _, weight in expansions),
+                             reverse=True):
+            if after is not None and weight > after[0]:
+                continue
+            start_after = None
+            if after is not None and weight == after[0]:
+                start_after = after[1]
+            # Songs matching a better scoring word were ranked with that score
+            better = [self._postings[token] for token, token_weight
+                      in expansions if token_weight > weight]
+            tails = []
+            for token, token_weight in expansions:
+                if token_weight == weight:
+                    postings = self._postings[token]
+                    start = 0
+                    if start_after is not None:
+                        start = bisect.bisect_right(postings, start_after)
+                    tails.append(_tail(postings, start))
+            last_id = None
+            for song_id in heapq.merge(*tails):
+                if song_id == last_id:
+                    continue
+                last_id = song_id
+                if any(_contains(postings, song_id) for postings in better):
+                    continue
+                results.append((song_id, weight))
+                if len(results) >= limit:
+                    return results
+        return results
+
+    def _expand(self, token, prefix, typos):
+        """Returns the indexed words a query word matches, with weights"""
+        expansions = []
+        if self._postings.get(token):
+            expansions.append((token, 1.0))
+        if prefix:
+            i = bisect.bisect_right(self._vocabulary, token)
+            for word in self._vocabulary[i:i + PREFIX_MAX_EXPANSIONS]:
+                if not word.startswith(token):
+                    break
+                if self._postings[word]:
+                    expansions.append((word, PREFIX_WEIGHT))
+        if not expansions and typos and len(token) >= FUZZY_MIN_LENGTH:
+            expansions = [(word, FUZZY_WEIGHT * similarity)
+                          for word, similarity in self._similar(token)]
+        return expansions
+
+    def _similar(self, token):
+        """Returns indexed words with a trigram similarity to the token of at
+        least FUZZY_MIN_SIMILARITY, most similar first
+        """
+        token_trigrams = trigrams(token)
+        shared = {}
+        # Only words of similar length can be similar enough
+        for length in xrange(len(token) - 2, len(token) + 3):
+            for trigram in token_trigrams:
+                for word in self._trigrams.get((trigram, length), ()):
+                    shared[word] = shared.get(word, 0) + 1
+        similar = []
+        for word, count in shared.iteritems():
+            # Dice coefficient, approximating the number of trigrams in a
+            # word by its length
+            similarity = 2.0 * count / (len(token_trigrams) + len(word) + 1)
+            if similarity >= FUZZY_MIN_SIMILARITY and self._postings[word]:
+                similar.append((word, similarity))
+        return heapq.nlargest(FUZZY_MAX_EXPANSIONS, similar,
+                              key=lambda (word, similarity): similarity)
+
+    def _add_trigrams(self, token):
+        for trigram in trigrams(token):
+            self._trigrams.setdefault((trigram, len(token)), []).append(token)
+
+    @staticmethod
+    def _tokens(texts):
+        tokens = set()
+        for text in texts:
+            if text:
+                tokens.update(tokenize(text))
+        return tokens
+
+
+class SongIndex(object):
+    """Indexes over the songs table, built from a single scan of it"""
+
+    def __init__(self):
+        self.prefixes = PrefixIndex()
+        self.tokens = TokenIndex()
+        self.song_ids = array('i')
+        self.loaded = False
+        self._loading = False
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def add_song(self, song):
+        """
+        Adds a song dict or Song to the index, if it has been loaded
+
+        The song must have an id. Raises ValueError, before changing the
+        index, if it doesn't.
+        """
+        if self.loaded:
+            song_id = _get(song, 'id')
+            if song_id is None:
+                raise ValueError('Songs must be inserted before being indexed')
+            texts = [_get(song, kind) for kind in SUGGESTION_KINDS]
+            for kind, text in zip(SUGGESTION_KINDS, texts):
+                self.prefixes.add(kind, text)
+            self.tokens.add(song_id, texts)
+            if not _contains(self.song_ids, song_id):
+                bisect.insort(self.song_ids, song_id)
+
+    def remove_song(self, song):
+        """Removes a song dict or Song from the index, if it has been loaded"""
+        if self.loaded:
+            texts = [_get(song, kind) for kind in SUGGESTION_KINDS]
+            for kind, text in zip(SUGGESTION_KINDS, texts):
+                self.prefixes.remove(kind, text)
+            song_id = _get(song, 'id')
+            self.tokens.remove(song_id, texts)
+            if _contains(self.song_ids, song_id):
+                del self.song_ids[bisect.bisect_left(self.song_ids, song_id)]
+
+    def suggest(self, query, limit=10):
+        self.refresh()
+        results = []
+        if query and self.loaded:
+            results = self.prefixes.search(query, limit)
+        return {'query': query, 'limit': limit, 'results': results}
+
+    def search(self, query, limit=20, typos=True, after=None):
+        """
+        Returns up to limit (song id, score) pairs for songs matching the
+        query, best first, starting after the (score, song id) pair after
+        """
+        self.refresh()
+        return self.tokens.search(query, limit, typos=typos, after=after)
+
+    def sample(self, k):
+        """Returns up to k distinct song ids chosen uniformly at random"""
+        self.refresh()
+        song_ids = self.song_ids
+        return random.sample(song_ids, min(k, len(song_ids)))
+
+    def refresh(self):
+        """
+        Starts loading the index in the background if it has not been loaded,
+        or if the songs table has been changed by another process
+        """
+        with self._lock:
+            if self._loading:
+                return
+            if (self.loaded and
+                    time.time() - self._checked_at < INDEX_CHECK_SEC):
+                return
+            self._loading = True
+        thread = threading.Thread(target=self._load)
+        thread.daemon = True
+        thread.start()
+
+    def _load(self):
+        try:
+            session = Session()
+            # Scans update modified songs in place, which changes the sum of
+            # their file mtimes but not their count or ids
+            signature = tuple(session.query(func.count(Song.id),
+                                            func.max(Song.id),
+                                            func.sum(Song.file_mtime)).one())
+            if signature != self._signature:
+                rows = (session.query(Song.id, Song.title, Song.artist,
+                                      Song.album).order_by(Song.id).all())
+                prefixes = PrefixIndex()
+                prefixes.load((kind, getattr(row, kind))
+                              for row in rows for kind in SUGGESTION_KINDS)
+                tokens = TokenIndex()
+                tokens.load((row.id, (row.title, row.artist, row.album))
+                            for row in rows)
+                self.prefixes = prefixes
+                self.tokens = tokens
+                self.song_ids = array('i', (row.id for row in rows))
+                self._signature = signature
+            session.commit()
+            self.loaded = True
+        finally:
+            self._checked_at = time.time()
+            self._loading = False
+
+
+def _contains(postings, song_id):
+    """Returns whether a sorted array contains the song id"""
+    i = bisect.bisect_left(postings, song_id)
+    return i < len(postings) and postings[i] == song_id
+
+
+def _tail(postings, start):
+    """Yields the song ids in postings from index start on"""
+    for i in xrange(start, len(postings)):
+        yield postings[i]
+
+
+def _get(song, key):
+    if isinstance(song, dict):
+        return song.get(key)
+    return getattr(song, key)
+
+
+song_index = SongIndex()
@@ -1,21 +1,102 @@
 from config import config
-from db import Song, PlayHistory, Session, engine
+from db import Song, PlayHistory, SongPlayStats, ArtistPlayStats
+from db import HourlySongPlays, DailySongPlays
+from db import Session, engine
+from search_index import song_index
 import art
 from os import walk
+from stat import S_ISREG
+import os
+import base64
+import datetime
 import hashlib
-from os.path import split, splitext, join, isfile
-from mutagen.mp3 import EasyMP3
+import json
+import multiprocessing
+import random
+import re
+from os.path import split, splitext, join
+from mutagen.mp3 import MP3
 from mutagen.flac import FLAC
 from mutagen.oggvorbis import OggVorbis
 from mutagen.mp4 import MP4
+from sqlalchemy import Float
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql import select
-from sqlalchemy.sql.expression import or_, func
+from sqlalchemy.sql.expression import (or_, and_, func, bindparam,
+                                       ColumnElement)
 
 PLAYER_NAME = config.get('Player', 'player_name')
 
+FULLTEXT_MIN_TOKEN_SIZE = 3
+"""Shortest word indexed by InnoDB (innodb_ft_min_token_size)"""
+
+FULLTEXT_STOPWORDS = frozenset([
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en',
+    'for', 'from', 'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or',
+    'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'who',
+    'will', 'with', 'und', 'www',
+])
+"""InnoDB's default full-text stopwords, which never match"""
+
+TOP_WINDOWS = {
+    'day': (HourlySongPlays, 'hour', datetime.timedelta(hours=23)),
+    'week': (DailySongPlays, 'day', datetime.timedelta(days=6)),
+    'month': (DailySongPlays, 'day', datetime.timedelta(days=29)),
+}
+"""Bucketed play counts and period to sum over for each top songs window,
+not counting the current bucket
+"""
+
+HOURLY_PLAYS_KEPT = max(period for model, _, period in TOP_WINDOWS.values()
+                        if model is HourlySongPlays)
+"""Age of the oldest hourly bucket that any window reads"""
+
+SONG_EXTENSIONS = {'.mp3', '.flac', '.ogg', '.m4a', '.mp4'}
+
+ID3_TAGS = {'title': 'TIT2', 'artist': 'TPE1', 'album': 'TALB',
+            'tracknumber': 'TRCK'}
+"""ID3 frames for the tags that EasyID3 would read"""
+
+MP4_TAGS = {'title': '\xa9nam', 'artist': '\xa9ART', 'album': '\xa9alb',
+            'tracknumber': 'trkn'}
+
+SCAN_PROCESSES = (config.getint('Scanner', 'processes')
+                  if config.has_option('Scanner', 'processes') else 1)
+"""Default number of processes to parse and hash files with when scanning"""
+
+SCAN_CHUNK_SIZE = 16
+"""Number of files to hand to a scanner process at a time"""
+
+SCAN_BATCH_SIZE = (config.getint('Scanner', 'batch_size')
+                   if config.has_option('Scanner', 'batch_size') else 500)
+"""Number of songs to insert or delete per transaction when scanning"""
+
+RANDOM_MAX_ATTEMPTS = 3
+"""Number of times to sample again for songs deleted since the last sample"""
+
+
+class FulltextMatch(ColumnElement):
+    """Boolean mode MATCH ... AGAINST over the songs full-text index"""
+    type = Float()
+
+    def __init__(self, terms):
+        songs = Song.__table__
+        self.columns = [songs.c.title, songs.c.artist, songs.c.album]
+        self.terms = bindparam('terms', terms, unique=True)
+
+
+@compiles(FulltextMatch)
+def _compile_fulltext_match(element, compiler, **kw):
+    columns = [compiler.process(column, **kw) for column in element.columns]
+    return 'MATCH (%s) AGAINST (%s IN BOOLEAN MODE)' % (
+        ', '.join(columns), compiler.process(element.terms, **kw))
+
 
 def remove_songs_in_dir(path):
     session = Session()
+    if song_index.loaded:
+        for song in session.query(Song).filter(Song.path.like(path + '%')):
+            song_index.remove_song(song)
     session.query(Song).filter(Song.path.like(path + '%')).delete(
         synchronize_session='fetch')
     session.commit()
@@ -37,140 +118,469 @@ def md5_for_file(f, block_size=2**20):
 
 
 def _prune_dir(path, prune_modified=False):
-    """Prunes songs in directory and returns set of remaining songs."""
+    """Prunes songs in directory and returns set of remaining songs.
+
+    Only songs whose files are missing are deleted. Songs whose file size,
+    mtime or inode changed since they were scanned are parsed again and
+    updated in place, keeping their ids and play history. With
+    prune_modified, they are only parsed again if their checksum changed too,
+    and songs scanned before file stats were recorded are checksummed.
+    """
     session = Session()
 
     songs = session.query(Song).filter(Song.path.like(path + '%')).all()
     remaining_paths = set()
+    pruned_ids = []
     for song in songs:
-        if not isfile(song.path):
-            session.delete(song)
+        stat = _file_stat(song.path)
+        if stat is None:
+            song_index.remove_song(song)
+            pruned_ids.append(song.id)
             print 'Pruned (deleted): ' + song.path
             continue
+        remaining_paths.add(song.path)
 
+        scanned = song.file_size is not None
+        unchanged = scanned and all(
+            getattr(song, column) == value for column, value in stat.items())
+        if unchanged:
+            continue
+        if not prune_modified and not scanned:
+            # Scanned before file stats were recorded; assume it is unchanged
+            _set_columns(song, stat)
+            continue
+
+        checksum = None
         if prune_modified:
             with open(song.path, 'rb') as f:
-                if song.checksum != md5_for_file(f):
-                    session.delete(song)
-                    print 'Pruned (modified or no checksum): ' + song.path
-                    continue
-                else:
-                    remaining_paths.add(song.path)
-        else:
-            remaining_paths.add(song.path)
-
+                checksum = md5_for_file(f)
+            if song.checksum == checksum:
+                # Same contents; record the stats to skip it next time
+                _set_columns(song, stat)
+                continue
+        _update_song(song, checksum)
     session.commit()
+
+    for i in xrange(0, len(pruned_ids), SCAN_BATCH_SIZE):
+        (session.query(Song)
+         .filter(Song.id.in_(pruned_ids[i:i + SCAN_BATCH_SIZE]))
+         .delete(synchronize_session=False))
+        session.commit()
     return remaining_paths
 
 
-def add_songs_in_dir(path, store_checksum=False):
+def _update_song(song, checksum=None):
+    """Parses a song's file again and updates its row in place
+
+    Returns whether the file could be parsed. If not, the row is left as it
+    is, so the file is tried again on the next scan.
+    """
+    song_obj = _parse_song(song.path)
+    if song_obj is None:
+        print 'Not updated (unreadable or missing tags): ' + song.path
+        return False
+    if checksum is not None:
+        song_obj['checksum'] = checksum
+    song_index.remove_song(song)
+    _set_columns(song, song_obj)
+    song_index.add_song(song)
+    print 'Updated: ' + song.path
+    return True
+
+
+def _set_columns(song, values):
+    for column, value in values.items():
+        setattr(song, column, value)
+
+
+def _file_stat(filepath):
+    """Returns the file stats stored for a song, or None if it doesn't exist"""
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    if not S_ISREG(stat.st_mode):
+        return None
+    return {'file_size': stat.st_size, 'file_mtime': int(stat.st_mtime),
+            'file_inode': stat.st_ino}
+
+
+def add_songs_in_dir(path, store_checksum=False, processes=None):
     """Update database to reflect the contents of the given directory.
 
+    Files are parsed again if their size, mtime or inode changed since they
+    were last scanned.
+
     store_checksum: Whether or not to store an MD5 file checksum in order to
-    update the song metadata in the database if the file is modified. Disabled
-    by default because it makes scanning a lot slower.
+    only parse changed files again if their contents changed. Disabled by
+    default because it makes scanning new files a lot slower.
+
+    processes: Number of worker processes to parse and hash files with, or 1
+    to parse them in this process. Defaults to [Scanner] processes in the
+    config file, or 1.
     """
     already_added = _prune_dir(path, prune_modified=store_checksum)
-    table = Song.__table__
+    filepaths = _find_songs(path, already_added)
+    return _add_songs(filepaths, store_checksum, processes)
+
+
+def add_song_files(filepaths, store_checksum=False, processes=None):
+    """Adds songs for the given files, or updates the songs already added
+    for them in place, keeping their ids and play history
+
+    Lifetime artist play counts stay with a song's old artist if its artist
+    tag changed; see top_artists.
+
+    Returns the number of songs added or updated.
+    """
+    filepaths = [filepath for filepath in filepaths
+                 if splitext(filepath)[1] in SONG_EXTENSIONS]
+    if not filepaths:
+        return 0
+    session = Session()
+    existing = dict((song.path, song) for song in
+                    session.query(Song).filter(Song.path.in_(filepaths)))
+    num_updated = 0
+    for song in existing.itervalues():
+        if _file_stat(song.path) is None:  # Removed in the meantime
+            continue
+        checksum = None
+        if store_checksum:
+            with open(song.path, 'rb') as f:
+                checksum = md5_for_file(f)
+        if _update_song(song, checksum):
+            num_updated += 1
+    session.commit()
+
+    new_filepaths = [filepath for filepath in filepaths
+                     if filepath not in existing]
+    return num_updated + _add_songs(new_filepaths, store_checksum, processes)
+
+
+def remove_song_files(filepaths):
+    """Removes the songs for the given files"""
+    if not filepaths:
+        return
+    session = Session()
+    song_ids = []
+    for song in session.query(Song).filter(Song.path.in_(filepaths)):
+        song_index.remove_song(song)
+        song_ids.append(song.id)
+        print 'Removed: ' + song.path
+    for i in xrange(0, len(song_ids), SCAN_BATCH_SIZE):
+        (session.query(Song)
+         .filter(Song.id.in_(song_ids[i:i + SCAN_BATCH_SIZE]))
+         .delete(synchronize_session=False))
+        session.commit()
+    session.commit()
+
+
+def _add_songs(filepaths, store_checksum=False, processes=None):
+    """Parses the given files and inserts songs for them
+
+    Returns the number of songs added.
+    """
+    if processes is None:
+        processes = SCAN_PROCESSES
+    art.clear_scan_cache()
+    args = ((filepath, store_checksum) for filepath in filepaths)
+
+    pool = None
+    if processes > 1:
+        # Don't share pooled database connections with the workers
+        engine.dispose()
+        pool = multiprocessing.Pool(processes)
+        songs = pool.imap_unordered(_parse_song_args, args,
+                                    chunksize=SCAN_CHUNK_SIZE)
+    else:
+        songs = (_parse_song_args(arg) for arg in args)
+
     conn = engine.connect()
     num_songs = 0
+    batch = []
+    try:
+        for song_obj in songs:
+            if song_obj is None:
+                continue
+            print 'Added: ' + song_obj['path']
+            batch.append(song_obj)
+            if len(batch) >= SCAN_BATCH_SIZE:
+                num_songs += _insert_songs(conn, batch)
+                batch = []
+        num_songs += _insert_songs(conn, batch)
+    finally:
+        conn.close()
+        if pool:
+            pool.terminate()
+    return num_songs
+
+
+def _find_songs(path, already_added):
+    """Yields the paths of songs in a directory that have not been added"""
     for root, _, files in walk(path):
         for f in files:
             ext = splitext(f)[1]
             filepath = join(root, f).decode('utf-8')
-            if ext in {'.mp3', '.flac', '.ogg', '.m4a', '.mp4'}:
+            if ext in SONG_EXTENSIONS:
                 if filepath in already_added:
                     print 'Already added: ' + filepath
                     continue
+                yield filepath
 
-                try:
-                    if ext == '.mp3':
-                        song = EasyMP3(filepath)
-                    elif ext == '.flac':
-                        song = FLAC(filepath)
-                    elif ext == '.ogg':
-                        song = OggVorbis(filepath)
-                    elif ext in {'.m4a', '.mp4'}:
-                        song = MP4(filepath)
-                except IOError, e:
-                    print e
-                    continue
 
-                # Required tags
-                try:
-                    if ext in {'.m4a', '.mp4'}:
-                        title = song.tags['\xa9nam'][0]
-                        artist = song.tags['\xa9ART'][0]
-                    else:
-                        title = song.tags['title'][0]
-                        artist = song.tags['artist'][0]
-                except Exception:
-                    print 'Missing tags: ' + filepath
-                    continue
+def _parse_song_args(args):
+    return _parse_song(*args)
+
+
+def _parse_song(filepath, store_checksum=False):
+    """Returns the songs table row for a file, or None if it can't be added
+
+    Also extracts the song's album art if there isn't any yet. Tags, length
+    and artwork are all read from a single parse of the file.
+    """
+    ext = splitext(filepath)[1]
+    # Stat before parsing, so that changes made while parsing are caught by
+    # the next scan
+    stat = _file_stat(filepath)
+    if stat is None:
+        return None
+    try:
+        if ext == '.mp3':
+            song = MP3(filepath)
+        elif ext == '.flac':
+            song = FLAC(filepath)
+        elif ext == '.ogg':
+            song = OggVorbis(filepath)
+        elif ext in {'.m4a', '.mp4'}:
+            song = MP4(filepath)
+    except IOError, e:
+        print e
+        return None
+
+    # Required tags
+    try:
+        title = _get_tag(song, 'title')
+        artist = _get_tag(song, 'artist')
+    except Exception:
+        print 'Missing tags: ' + filepath
+        return None
+
+    song_obj = {
+        'title': title,
+        'artist': artist,
+        'length': song.info.length,
+        'path': filepath,
+    }
+    song_obj.update(stat)
+
+    # Calculate and store file checksum
+    if store_checksum:
+        with open(filepath, 'rb') as song_file:
+            song_obj['checksum'] = md5_for_file(song_file)
+
+    try: # Album optional for singles
+        song_obj['album'] = _get_tag(song, 'album')
+    except Exception:
+        song_obj['album'] = None
+
+    try: # Track number optional
+        if isinstance(song, MP4):
+            song_obj['tracknumber'] = _get_tag(song, 'tracknumber')[0]
+        else:
+            song_obj['tracknumber'] = int(_get_tag(song, 'tracknumber'))
+    except Exception:
+        song_obj['tracknumber'] = None
+
+    # Album art added on indexing
+    if art.needs_art(song_obj['artist'], song_obj['album']):
+        art.save_art(song_obj, art.embedded_art(song))
+
+    return song_obj
 
-                song_obj = {
-                    'title': title,
-                    'artist': artist,
-                    'length': song.info.length,
-                    'path': filepath,
-                }
-
-                # Calculate and store file checksum
-                if store_checksum:
-                    with open(filepath, 'rb') as song_file:
-                        song_obj['checksum'] = md5_for_file(song_file)
-
-                try: # Album optional for singles
-                    if ext in {'.m4a', '.mp4'}:
-                        song_obj['album'] = song.tags['\xa9alb'][0]
-                    else:
-                        song_obj['album'] = song.tags['album'][0]
-                except Exception:
-                    song_obj['album'] = None
-
-                try: # Track number optional
-                    if ext in {'.m4a', '.mp4'}:
-                        song_obj['tracknumber'] = song.tags['trkn'][0][0]
-                    else:
-                        song_obj['tracknumber'] = (
-                            int(song.tags['tracknumber'][0]))
-                except Exception:
-                    song_obj['tracknumber'] = None
-
-                # Album art added on indexing
-                if not art.get_art(song_obj['artist'], song_obj['album']):
-                    art.index_art(song_obj)
-
-                print 'Added: ' + filepath
-                conn.execute(table.insert().values(song_obj))
-                num_songs += 1
-
-    conn.close()
-    return num_songs
 
+def _get_tag(song, tag):
+    """Returns the first value of a tag of a parsed file
 
-def search_songs(query, limit=20):
+    Raises an exception if the file doesn't have the tag.
+    """
+    if isinstance(song, MP3):
+        return song.tags[ID3_TAGS[tag]].text[0]
+    elif isinstance(song, MP4):
+        return song.tags[MP4_TAGS[tag]][0]
+    return song.tags[tag][0]
+
+
+def _insert_songs(conn, songs):
+    """Inserts songs table rows with a single statement in one transaction
+
+    Returns the number of songs inserted.
+    """
+    if not songs:
+        return 0
+    table = Song.__table__
+    index_loaded = song_index.loaded
+    with conn.begin():
+        conn.execute(table.insert(), songs)
+        if index_loaded:
+            # executemany doesn't return the new ids, so look them up by path
+            paths = [song_obj['path'] for song_obj in songs]
+            ids = dict((row.path, row.id) for row in conn.execute(
+                select([table.c.id, table.c.path])
+                .where(table.c.path.in_(paths))))
+    if index_loaded:
+        for song_obj in songs:
+            song_index.add_song(dict(song_obj, id=ids.get(song_obj['path'])))
+    return len(songs)
+
+
+def search_songs(query, limit=20, mode=None, cursor=None):
+    """Searches song titles, artists and albums, ordered by relevance.
+
+    Uses the songs full-text index, requiring every word of the query to
+    prefix-match a word in the song. Falls back to substring matching if no
+    word in the query is long enough to be indexed.
+
+    mode: 'normalized' to search the in-memory word index instead, which
+    ignores case and accents and tolerates misspelled words. Uses the
+    full-text index while the in-memory index is still loading.
+
+    cursor: The next_cursor of the previous page of results. Raises
+    ValueError if it is invalid.
+    """
     songs = []
-    if query:
+    next_cursor = None
+    if query and mode == 'normalized' and song_index.loaded:
+        after = None
+        if cursor:
+            after = decode_cursor(cursor, 2)
+        ranked = song_index.search(query, limit=limit, after=after)
+        res = get_songs([song_id for song_id, _ in ranked])
+        songs = [res[song_id] for song_id, _ in ranked if song_id in res]
+        if len(ranked) == limit:
+            next_cursor = encode_cursor(ranked[-1][1], ranked[-1][0])
+    elif query:
         session = Session()
-        res = session.query(Song).filter(or_(
-            Song.title.like('%' + query + '%'),
-            Song.artist.like('%' + query + '%'),
-            Song.album.like('%' + query + '%')
-        )).limit(limit).all()
+        terms = _fulltext_terms(query)
+        if terms:
+            match = FulltextMatch(terms)
+            # InnoDB relevance is single precision, so it only compares equal
+            # to the value sent back in a cursor once rounded
+            relevance = func.round(match, 6)
+            q = session.query(Song, relevance).filter(match > 0)
+            if cursor:
+                last_relevance, last_id = decode_cursor(cursor, 2)
+                q = q.filter(or_(relevance < last_relevance,
+                                 and_(relevance == last_relevance,
+                                      Song.id > last_id)))
+            res = (q.order_by(relevance.desc(), Song.id)
+                   .limit(limit).all())
+            if len(res) == limit:
+                next_cursor = encode_cursor(res[-1][1], res[-1][0].id)
+            res = [song for song, _ in res]
+        else:
+            q = session.query(Song).filter(or_(
+                Song.title.like('%' + query + '%'),
+                Song.artist.like('%' + query + '%'),
+                Song.album.like('%' + query + '%')
+            ))
+            if cursor:
+                last_id, = decode_cursor(cursor, 1)
+                q = q.filter(Song.id > last_id)
+            res = q.order_by(Song.id).limit(limit).all()
+            if len(res) == limit:
+                next_cursor = encode_cursor(res[-1].id)
         session.commit()
         songs = [song.dictify() for song in res]
-    return {'query': query, 'limit': limit, 'results': songs}
+    return {'query': query, 'limit': limit, 'results': songs,
+            'next_cursor': next_cursor}
 
 
-def random_songs(limit=20):
+def _fulltext_terms(query):
+    """Converts a search query to a boolean mode full-text search string"""
+    words = [word for word in re.split(r'\W+', query.lower(), flags=re.UNICODE)
+             if len(word) >= FULLTEXT_MIN_TOKEN_SIZE and
+             word not in FULLTEXT_STOPWORDS]
+    return ' '.join('+' + word + '*' for word in words)
+
+
+def encode_cursor(*values):
+    """Returns an opaque pagination cursor for the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(values))
+
+
+def decode_cursor(cursor, num_values):
+    """Returns the values in a pagination cursor
+
+    Raises ValueError if the cursor is invalid.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != num_values:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def get_songs(song_ids):
+    """Returns a dict of song ids to songs, loaded with a single query"""
+    if not song_ids:
+        return {}
     session = Session()
-    res = session.query(Song).order_by(func.rand()).limit(limit).all()
+    res = session.query(Song).filter(Song.id.in_(song_ids)).all()
+    songs = dict((song.id, song.dictify()) for song in res)
     session.commit()
-    songs = [song.dictify() for song in res]
+    return songs
+
+
+def random_songs(limit=20):
+    """Returns up to limit distinct songs chosen at random
+
+    Samples ids from the in-memory song index, or picks random points in the
+    range of song ids while the index is loading, then looks the songs up by
+    primary key. Songs deleted by another process since the index was last
+    refreshed are not found and are replaced by another sample.
+    """
+    songs = []
+    seen = set()
+    for _ in xrange(RANDOM_MAX_ATTEMPTS):
+        wanted = limit - len(songs)
+        if song_index.loaded:
+            song_ids = song_index.sample(wanted)
+        else:
+            song_index.refresh()
+            song_ids = _random_song_ids(wanted)
+        song_ids = [song_id for song_id in song_ids if song_id not in seen]
+        seen.update(song_ids)
+        res = get_songs(song_ids)
+        songs.extend(res[song_id] for song_id in song_ids if song_id in res)
+        if len(songs) >= limit or not song_ids:
+            break
     return {'query': '', 'limit': limit, 'results': songs}
 
 
+def _random_song_ids(k):
+    """Returns up to k song ids at random points in the range of song ids
+
+    Each lookup is a single index seek. Songs that follow gaps in the ids are
+    more likely to be chosen.
+    """
+    session = Session()
+    min_id, max_id = (session.query(func.min(Song.id), func.max(Song.id))
+                      .one())
+    song_ids = set()
+    if min_id is not None:
+        for _ in xrange(2 * k):
+            song_id = (session.query(Song.id)
+                       .filter(Song.id >= random.randint(min_id, max_id))
+                       .order_by(Song.id).limit(1).scalar())
+            song_ids.add(song_id)
+            if len(song_ids) >= k:
+                break
+    session.commit()
+    return list(song_ids)
+
+
 def get_albums_for_artist(artist):
     songs = Song.__table__
     albums = []
@@ -187,58 +597,143 @@ def get_albums_for_artist(artist):
     return {'query': artist, 'results': albums}
 
 
-def get_album(album):
+def get_album(album, limit=None, cursor=None):
+    """Returns the songs in an album in track order
+
+    limit: Maximum number of songs to return, or None to return all of them.
+    cursor: The next_cursor of the previous page of songs. Raises ValueError
+    if it is invalid.
+    """
     songs = []
+    next_cursor = None
     if album:
         session = Session()
-        res = (session.query(Song).filter_by(album=album)
-               .order_by(Song.tracknumber, Song.path).all())
+        q = session.query(Song).filter_by(album=album)
+        if cursor:
+            tracknumber, path, song_id = decode_cursor(cursor, 3)
+            after_track = or_(Song.path > path,
+                              and_(Song.path == path, Song.id > song_id))
+            if tracknumber is None:
+                # Songs without track numbers sort first
+                q = q.filter(or_(and_(Song.tracknumber == None, after_track),
+                                 Song.tracknumber != None))
+            else:
+                q = q.filter(or_(Song.tracknumber > tracknumber,
+                                 and_(Song.tracknumber == tracknumber,
+                                      after_track)))
+        q = q.order_by(Song.tracknumber, Song.path, Song.id)
+        if limit:
+            q = q.limit(limit)
+        res = q.all()
         session.commit()
+        if limit and len(res) == limit:
+            last = res[-1]
+            next_cursor = encode_cursor(last.tracknumber, last.path, last.id)
         songs = [song.dictify() for song in res]
-    return {'query': album, 'results': songs}
+    return {'query': album, 'results': songs, 'next_cursor': next_cursor}
+
+def get_history(limit=20, cursor=None):
+    """Returns recently played songs, most recent first
 
-def get_history(limit=20):
+    cursor: The next_cursor of the previous page of history. Raises
+    ValueError if it is invalid.
+    """
     session = Session()
-    history_items = (session.query(PlayHistory)
-                     .filter_by(player_name=PLAYER_NAME)
-                     .order_by(PlayHistory.id.desc()).limit(limit).all())
+    q = (session.query(PlayHistory.id, PlayHistory.played_at, Song)
+         .join(Song, PlayHistory.song_id == Song.id)
+         .filter(PlayHistory.player_name == PLAYER_NAME))
+    if cursor:
+        last_id, = decode_cursor(cursor, 1)
+        q = q.filter(PlayHistory.id < last_id)
+    res = q.order_by(PlayHistory.id.desc()).limit(limit).all()
+    songs = []
+    for _, played_at, song in res:
+        song_obj = song.dictify()
+        song_obj['played_at'] = str(played_at)
+        songs.append(song_obj)
     session.commit()
+    next_cursor = None
+    if len(res) == limit:
+        next_cursor = encode_cursor(res[-1][0])
+    return {'limit': limit, 'results': songs, 'next_cursor': next_cursor}
+
+
+def top_songs(limit=20, window=None):
+    """Returns this player's most played songs
+
+    window: 'day', 'week' or 'month' to count only plays in that period,
+    summed from bucketed play counts. Raises ValueError for other windows.
+    """
+    session = Session()
+    if window:
+        plays = _window_plays(window)
+        res = (session.query(Song, plays.c.play_count)
+               .join(plays, plays.c.song_id == Song.id)
+               .order_by(plays.c.play_count.desc())
+               .limit(limit).all())
+    else:
+        res = (session.query(Song, SongPlayStats.play_count)
+               .join(SongPlayStats, SongPlayStats.song_id == Song.id)
+               .filter(SongPlayStats.player_name == PLAYER_NAME)
+               .order_by(SongPlayStats.play_count.desc())
+               .limit(limit).all())
     songs = []
-    for item in history_items:
-        song_obj = session.query(Song).get(item.song_id).dictify()
-        song_obj['played_at'] = str(item.played_at)
+    for song, play_count in res:
+        song_obj = song.dictify()
+        # Plays on this player (in the window), which songs are ranked by
+        song_obj['play_count'] = int(play_count)
         songs.append(song_obj)
-    return {'limit': limit, 'results': songs}
+    session.commit()
+    return {'limit': limit, 'window': window, 'results': songs}
 
 
-def top_songs(limit=20):
-    songs = Song.__table__
-    play_history = PlayHistory.__table__
-    conn = engine.connect()
-    cols = [songs.c.id, func.count(play_history.c.id).label('play_count')]
-    s = (select(cols)
-         .select_from(songs.join(play_history))
-         .group_by(songs.c.id)
-         .order_by('play_count DESC')
-         .limit(limit))
-    res = conn.execute(s)
-    conn.close()
+def top_artists(limit=20, window=None):
+    """Returns this player's most played artists
+
+    window: 'day', 'week' or 'month' to count only plays in that period,
+    summed from bucketed play counts. Raises ValueError for other windows.
+
+    Without a window, plays are credited to the artist a song had when it was
+    played. Windowed plays are credited to its current artist, so the two
+    disagree about songs whose artist tag has changed since.
+    """
     session = Session()
-    songs = [session.query(Song).get(song[0]).dictify() for song in res]
+    if window:
+        plays = _window_plays(window)
+        play_count = func.sum(plays.c.play_count).label('play_count')
+        res = (session.query(Song.artist, play_count)
+               .join(plays, plays.c.song_id == Song.id)
+               .filter(Song.artist != None)
+               .group_by(Song.artist)
+               .order_by(play_count.desc())
+               .limit(limit).all())
+    else:
+        res = (session.query(ArtistPlayStats.artist,
+                             ArtistPlayStats.play_count)
+               .filter_by(player_name=PLAYER_NAME)
+               .order_by(ArtistPlayStats.play_count.desc())
+               .limit(limit).all())
+    artists = [{'artist': artist, 'play_count': int(count)}
+               for artist, count in res]
     session.commit()
-    return {'limit': limit, 'results': songs}
+    return {'limit': limit, 'window': window, 'results': artists}
 
 
-def top_artists(limit=20):
-    songs = Song.__table__
-    play_history = PlayHistory.__table__
-    conn = engine.connect()
-    cols = [songs.c.artist, func.count(play_history.c.id).label('play_count')]
-    s = (select(cols)
-         .select_from(songs.join(play_history))
-         .group_by(songs.c.artist)
-         .order_by('play_count DESC')
-         .limit(limit))
-    res = [{'artist': row[0], 'play_count': row[1]} for row in conn.execute(s)]
-    conn.close()
-    return {'limit': limit, 'results': res}
+def _window_plays(window):
+    """Returns a subquery of (song_id, play_count) for this player's plays in
+    a window, summed from the buckets that cover it
+    """
+    if window not in TOP_WINDOWS:
+        raise ValueError('Unknown window %s' % window)
+    model, column, period = TOP_WINDOWS[window]
+    start = datetime.datetime.utcnow() - period
+    if model is HourlySongPlays:
+        start = start.replace(minute=0, second=0, microsecond=0)
+    else:
+        start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (select([model.song_id,
+                    func.sum(model.play_count).label('play_count')])
+            .where(model.player_name == PLAYER_NAME)
+            .where(getattr(model, column) >= start)
+            .group_by(model.song_id)
+            .alias('window_plays'))
@@ -877,62 +877,64 @@ function($scope, $http, $interval, $cookies)
             index: index
         });
     };
-    $scope.refreshPlayer = function()
+    $scope.updateNowPlaying = function(data)
     {
-        $http.get(backendBase + '/v1/now_playing')
-        .success(function(data)
+        if (data['media']) {
+            // Convert to seconds
+            $scope.playbackTime = data['player_status']['current_time'] / 1000;
+            $scope.playbackDuration = data['media']['length'];
+        }
+        else {
+            $scope.playbackTime = 0;
+            $scope.playbackDuration = 0;
+        }
+        // Prevent setting the volume while the user is changing it
+        if (!$scope.holdVolumeUpdate)
         {
-            if (data['media']) {
-                // Convert to seconds
-                $scope.playbackTime = data['player_status']['current_time'] / 1000;
-                $scope.playbackDuration = data['media']['length'];
+            $scope.volume = data['player_status']['volume'];
+        }
+        // Check for equalizer support
+        if (data['player_status']['equalizer_enabled'] !== undefined)
+        {
+            // Prevent enabling/disabling the equalizer while the user is changing it
+            if (!$scope.holdEqEnabledUpdate)
+            {
+                $scope.eqEnabled = data['player_status']['equalizer_enabled'];
             }
-            else {
-                $scope.playbackTime = 0;
-                $scope.playbackDuration = 0;
+            // Prevent changing the equalizer preset while the user is changing it
+            if (!$scope.holdEqPresetUpdate)
+            {
+                $scope.eqPresetIndex = data['player_status']['equalizer_preset'];
             }
-            // Prevent setting the volume while the user is changing it
-            if (!$scope.holdVolumeUpdate)
+            // Prevent changing the preamp while the user is changing it
+            if (!$scope.holdEqPreampUpdate)
             {
-                $scope.volume = data['player_status']['volume'];
+                $scope.eqPreampLevel = data['player_status']['equalizer_preamp_level'];
             }
-            // Check for equalizer support
-            if (data['player_status']['equalizer_enabled'] !== undefined)
+            levels = data['player_status']['equalizer_band_levels'];
+            for (var bandIdx = 0; bandIdx < levels.length; bandIdx++)
             {
-                // Prevent enabling/disabling the equalizer while the user is changing it
-                if (!$scope.holdEqEnabledUpdate)
+                var holdName = 'holdEqBand' + bandIdx + 'Update';
+                var hold = $scope[holdName];
+                if ($scope[holdName] === undefined)
                 {
-                    $scope.eqEnabled = data['player_status']['equalizer_enabled'];
+                    $scope[holdName] = false;
                 }
-                // Prevent changing the equalizer preset while the user is changing it
-                if (!$scope.holdEqPresetUpdate)
+                // Prevent changing the band while the user is changing it
+                if (!$scope[holdName])
                 {
-                    $scope.eqPresetIndex = data['player_status']['equalizer_preset'];
-                }
-                // Prevent changing the preamp while the user is changing it
-                if (!$scope.holdEqPreampUpdate)
-                {
-                    $scope.eqPreampLevel = data['player_status']['equalizer_preamp_level'];
-                }
-                levels = data['player_status']['equalizer_band_levels'];
-                for (var bandIdx = 0; bandIdx < levels.length; bandIdx++)
-                {
-                    var holdName = 'holdEqBand' + bandIdx + 'Update';
-                    var hold = $scope[holdName];
-                    if ($scope[holdName] === undefined)
-                    {
-                        $scope[holdName] = false;
-                    }
-                    // Prevent changing the band while the user is changing it
-                    if (!$scope[holdName])
-                    {
-                        $scope['bandLevel' + bandIdx] = levels[bandIdx];
-                    }
+                    $scope['bandLevel' + bandIdx] = levels[bandIdx];
                 }
-                $scope.updateEqLabels(-2);
             }
-            $scope.isPlaying = data['player_status']['state'] == 'State.Playing';
-        });
+            $scope.updateEqLabels(-2);
+        }
+        $scope.isPlaying = data['player_status']['state'] == 'State.Playing';
+    };
+
+    $scope.refreshPlayer = function()
+    {
+        $http.get(backendBase + '/v1/now_playing')
+        .success($scope.updateNowPlaying);
 
         var params = {};
         if ($scope.loggedIn)
@@ -950,11 +952,130 @@ function($scope, $http, $interval, $cookies)
     };
 
     //
-    // Intervals
+    // Player events
     //
 
-    // Frequency, check the the status of the player and queue
-    $interval($scope.refreshPlayer, 1000);
+    var eventSource = null;
+    var eventSourceUser = null;
+    var queueItems = {};
+    var pollTimer = null;
+
+    var queueKey = function(item)
+    {
+        return String(item['url'] || item['id']);
+    };
+
+    var startPolling = function()
+    {
+        if (!pollTimer)
+        {
+            pollTimer = $interval($scope.refreshPlayer, 1000);
+        }
+    };
+
+    var stopPolling = function()
+    {
+        if (pollTimer)
+        {
+            $interval.cancel(pollTimer);
+            pollTimer = null;
+        }
+    };
+
+    // Streams player and queue changes from /v1/events, falling back to
+    // polling if the browser or a proxy does not support server-sent events
+    $scope.connectEvents = function()
+    {
+        if (!window.EventSource)
+        {
+            startPolling();
+            return;
+        }
+
+        var user = $scope.loggedIn ? $scope.loggedIn['name'] : null;
+        if (eventSource)
+        {
+            if (user === eventSourceUser)
+            {
+                return;
+            }
+            eventSource.close();
+        }
+        eventSourceUser = user;
+        queueItems = {};
+
+        var url = backendBase + '/v1/events';
+        if (user)
+        {
+            url += '?user=' + encodeURIComponent(user);
+        }
+        // Keep polling until events actually arrive, since buffering proxies
+        // can hold back the stream indefinitely
+        startPolling();
+        eventSource = new EventSource(url);
+        eventSource.onerror = function()
+        {
+            // The browser reconnects on its own unless the stream is closed
+            startPolling();
+        };
+        eventSource.addEventListener('player', function(event)
+        {
+            stopPolling();
+            $scope.$apply(function()
+            {
+                $scope.updateNowPlaying(JSON.parse(event.data));
+            });
+        });
+        eventSource.addEventListener('tick', function(event)
+        {
+            var data = JSON.parse(event.data);
+            stopPolling();
+            $scope.$apply(function()
+            {
+                if ($scope.playbackDuration)
+                {
+                    // Convert to seconds
+                    $scope.playbackTime = data['current_time'] / 1000;
+                }
+                $scope.isPlaying = data['state'] == 'State.Playing';
+            });
+        });
+        eventSource.addEventListener('queue', function(event)
+        {
+            var data = JSON.parse(event.data);
+            stopPolling();
+            for (var key in data['items'])
+            {
+                queueItems[key] = data['items'][key];
+            }
+            var queue = [];
+            var items = {};
+            for (var queueIndex = 0; queueIndex < data['order'].length; queueIndex++)
+            {
+                var item = queueItems[data['order'][queueIndex]];
+                items[queueKey(item)] = item;
+                queue.push(item);
+            }
+            queueItems = items;
+            $scope.$apply(function()
+            {
+                $scope.queue = queue;
+            });
+        });
+    };
+
+    // Reconnect so that the queue reports whether the new user has voted
+    $scope.$watch('loggedIn', function()
+    {
+        if (eventSource)
+        {
+            $scope.connectEvents();
+        }
+    });
+
+    //
+    // Intervals
+    //
 
     // Every minute, check that the session has not expired
     $interval(function()
@@ -970,6 +1091,7 @@ function($scope, $http, $interval, $cookies)
     $scope.randomSongs();
     $scope.getEqualizerInfo();
     $scope.refreshPlayer();
+    $scope.connectEvents();
 }]);
 
 // Print banner
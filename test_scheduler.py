@@ -0,0 +1,98 @@
+"""
+Tests that the queue payload is built from a constant number of queries.
+
+Run from this directory with: python -m unittest test_scheduler
+"""
+
+from config import config
+import sys
+import types
+
+# Defaults for running without a beats.cfg; any configured values are kept
+for section, option, value in [('Player', 'player_name', 'test'),
+                               ('Database', 'url', 'sqlite://'),
+                               ('Artwork', 'art_path', '/static/art/'),
+                               ('SoundCloud', 'soundcloud_key', 'test')]:
+    if not config.has_section(section):
+        config.add_section(section)
+    if not config.has_option(section, option):
+        config.set(section, option, value)
+
+# Stand-in for the VLC player, which needs libvlc; nothing is playing
+player = types.ModuleType('player')
+player.now_playing = None
+sys.modules.setdefault('player', player)
+
+from db import Base, Session, Song
+from packet_queue import QueuedPacket
+from scheduler import Scheduler
+from sqlalchemy import create_engine, event
+import song
+import unittest
+
+
+class BuildQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        Session.configure(bind=self.engine)
+        session = Session()
+        session.add_all(Song(title=u'Song %d' % i, artist=u'Artist',
+                             album=u'Album', length=60.0, tracknumber=i,
+                             path=u'/music/%d.mp3' % i, play_count=i)
+                        for i in xrange(50))
+        session.commit()
+        self.song_ids = [row.id for row in
+                         session.query(Song.id).order_by(Song.id)]
+        session.commit()
+
+        self.num_queries = 0
+        event.listen(self.engine, 'before_cursor_execute', self._count_query)
+
+    def tearDown(self):
+        # Each test has its own engine, so its listener goes away with it
+        Session.configure(bind=None)
+
+    def _count_query(self, *args):
+        self.num_queries += 1
+
+    def _build_queue(self, num_songs):
+        packets = []
+        voters = []
+        for i, song_id in enumerate(self.song_ids[:num_songs]):
+            packet = QueuedPacket(user='user%d' % i, arrival_time=i,
+                                  length=60.0, song_id=song_id,
+                                  voters=['voter%d' % i])
+            packets.append(packet)
+            voters.append(packet.additional_voters | set([packet.user]))
+        self.num_queries = 0
+        return Scheduler._build_queue(packets, voters)
+
+    def test_single_query(self):
+        queue, _ = self._build_queue(50)
+        self.assertEqual(self.num_queries, 1)
+        self.assertEqual(len(queue), 50)
+        self.assertEqual([media_obj['id'] for media_obj in queue],
+                         self.song_ids)
+        self.assertEqual(queue[1]['play_count'], 1)
+        self.assertEqual(queue[1]['packet']['num_votes'], 2)
+
+    def test_query_count_is_constant(self):
+        self._build_queue(1)
+        one_song = self.num_queries
+        self._build_queue(50)
+        self.assertEqual(self.num_queries, one_song)
+
+    def test_empty_queue_runs_no_queries(self):
+        queue, _ = self._build_queue(0)
+        self.assertEqual(queue, [])
+        self.assertEqual(self.num_queries, 0)
+
+    def test_get_songs_skips_deleted_songs(self):
+        songs = song.get_songs(self.song_ids[:3] + [-1])
+        self.assertEqual(sorted(songs), self.song_ids[:3])
+        self.assertEqual(self.num_queries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""
+Virtual clock for the packet-by-packet GPS scheduler.
+
+Virtual time advances at 1 / active_sessions per second of wall-clock time.
+Rather than being stepped by the scheduler loop, it is integrated exactly over
+segments during which the number of active sessions is constant, so loop
+timing and stalls do not cause drift.
+"""
+
+import time
+
+
+class VirtualClock(object):
+    def __init__(self, virtual_time=0.0, clock=time.time):
+        self._clock = clock
+        self._active_sessions = 0
+        self.set(virtual_time)
+
+    def now(self):
+        """Returns the current virtual time"""
+        if self._active_sessions:
+            elapsed = self._clock() - self._segment_start
+            virtual_time = (self._segment_virtual_time +
+                            elapsed / self._active_sessions)
+            # Wall-clock time can step backwards; never let virtual time do so
+            self._latest = max(self._latest, virtual_time)
+        return self._latest
+
+    def set(self, virtual_time):
+        """Sets the virtual time and starts a new segment"""
+        self._segment_virtual_time = virtual_time
+        self._segment_start = self._clock()
+        self._latest = virtual_time
+
+    def set_active_sessions(self, active_sessions):
+        """Starts a new segment if the number of active sessions changed"""
+        if active_sessions != self._active_sessions:
+            self.set(self.now())
+            self._active_sessions = active_sessions
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Keeps the library up to date as files under /music change.
+# To be run from a production Beats server only.
+# Usage: ./watch_music.py [directory]
+import sys
+import time
+
+import pyinotify
+
+import song
+
+DEBOUNCE_SEC = 5.0
+"""Time to wait after the last change before updating the library"""
+
+MAX_DELAY_SEC = 60.0
+"""Longest time to delay updating the library during a burst of changes"""
+
+WATCH_MASK = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE |
+              pyinotify.IN_DELETE | pyinotify.IN_MOVED_TO |
+              pyinotify.IN_MOVED_FROM)
+
+# Change types, applied in this order
+REMOVE_DIR, REMOVE_FILE, ADD_DIR, ADD_FILE = range(4)
+
+
+class MusicDirEventHandler(pyinotify.ProcessEvent):
+    """Collects the latest change to each path until they are applied"""
+
+    def my_init(self, watch_manager):
+        self.watch_manager = watch_manager
+        self.pending = {}
+        self.first_change = None
+        self.last_change = None
+
+    def process_IN_CLOSE_WRITE(self, event):
+        self._changed(event, ADD_FILE)
+
+    def process_IN_MOVED_TO(self, event):
+        if event.dir:
+            # Directories moved in from outside the tree are not watched yet
+            if self.watch_manager.get_wd(event.pathname) is None:
+                self.watch_manager.add_watch(event.pathname, WATCH_MASK,
+                                             rec=True, auto_add=True)
+            self._changed(event, ADD_DIR)
+        else:
+            self._changed(event, ADD_FILE)
+
+    def process_IN_CREATE(self, event):
+        # Files copied into a new directory before it is watched are only
+        # found by scanning it
+        if event.dir:
+            self._changed(event, ADD_DIR)
+
+    def process_IN_DELETE(self, event):
+        self._changed(event, REMOVE_DIR if event.dir else REMOVE_FILE)
+
+    def process_IN_MOVED_FROM(self, event):
+        self._changed(event, REMOVE_DIR if event.dir else REMOVE_FILE)
+
+    def _changed(self, event, change):
+        path = event.pathname
+        if isinstance(path, str):
+            path = path.decode('utf-8')
+        self.pending[path] = change
+        self.last_change = time.time()
+        if self.first_change is None:
+            self.first_change = self.last_change
+
+    def due(self):
+        """Returns whether the pending changes should be applied now"""
+        if not self.pending:
+            return False
+        now = time.time()
+        return (now - self.last_change >= DEBOUNCE_SEC or
+                now - self.first_change >= MAX_DELAY_SEC)
+
+    def apply(self):
+        """
+        Applies the pending changes to the library
+
+        If that fails, the changes are kept pending, behind any newer
+        changes to the same paths, and retried after DEBOUNCE_SEC.
+        """
+        pending, self.pending = self.pending, {}
+        self.first_change = self.last_change = None
+        changes = [[] for _ in xrange(4)]
+        for path, change in pending.iteritems():
+            changes[change].append(path)
+
+        try:
+            for path in changes[REMOVE_DIR]:
+                song.remove_songs_in_dir(path + '/')
+            song.remove_song_files(changes[REMOVE_FILE])
+            for path in changes[ADD_DIR]:
+                song.add_songs_in_dir(path)
+            song.add_song_files(changes[ADD_FILE])
+        except Exception:
+            for path, change in pending.iteritems():
+                self.pending.setdefault(path, change)
+            self.last_change = time.time()
+            if self.first_change is None:
+                self.first_change = self.last_change
+            raise
+
+
+def watch(path):
+    watch_manager = pyinotify.WatchManager()
+    handler = MusicDirEventHandler(watch_manager=watch_manager)
+    notifier = pyinotify.Notifier(watch_manager, handler,
+                                  timeout=int(DEBOUNCE_SEC * 1000))
+    watch_manager.add_watch(path, WATCH_MASK, rec=True, auto_add=True)
+    print 'Watching ' + path
+    while True:
+        if notifier.check_events():
+            notifier.read_events()
+            notifier.process_events()
+        if handler.due():
+            try:
+                handler.apply()
+            except Exception, e:
+                print 'Error updating library: %s' % e
+
+
+if __name__ == '__main__':
+    watch(sys.argv[1] if len(sys.argv) > 1 else '/music')